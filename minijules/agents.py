@@ -82,6 +82,7 @@ def create_core_agent(config_list: List[Dict]) -> AssistantAgent:
 *   **版本控制与恢复 (Git)**
     *   `git_diff()`: 查看未暂存的更改，用于验证您的文件编辑操作。
     *   `git_add(filepath: str)`: 暂存文件。在 `submit` 前，所有相关文件都应被暂存。
+    *   `git_add_many(filepaths: list[str])`: 一次性暂存多个文件。
     *   `git_commit(message: str)`: （高级用法）用于在复杂任务中创建多个提交点。通常，您应该只在最后使用 `submit`。
     *   `restore_file(filepath: str)`: **安全工具**。当一次修改出错时，用此工具将单个文件恢复到任务开始时的状态。
     *   `reset_all()`: **终极安全工具**。当您完全陷入困境时，用此工具将整个工作区恢复到任务开始时的初始状态，然后可以重新规划和尝试。
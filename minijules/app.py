@@ -111,6 +111,7 @@ class JulesApp:
             tools.git_status,
             tools.git_diff,
             tools.git_add,
+            tools.git_add_many,
             tools.git_commit,
             tools.git_create_branch,
             tools.restore_file,
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import logging
 from pathlib import Path
 from typing import List, Dict, Any
@@ -80,9 +81,14 @@ def _traverse_and_collect(node, language, code_blocks, comments):
     for child in node.children:
         _traverse_and_collect(child, language, code_blocks, comments)
 
+@functools.lru_cache(maxsize=None)
+def _get_parser(language: str):
+    # 索引按文件顺序进行，每种语言复用同一个 Parser，避免为每个文件重新加载语法
+    return get_parser(language)
+
 def extract_chunks(file_path: Path, language: str) -> List[Dict[str, Any]]:
     try:
-        parser = get_parser(language)
+        parser = _get_parser(language)
         code = file_path.read_text(encoding='utf-8')
         tree = parser.parse(bytes(code, "utf8"))
 
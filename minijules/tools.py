@@ -1,22 +1,42 @@
 import os
+import ast
+import difflib
 import subprocess
+import atexit
+import queue
+import shlex
+import threading
+import uuid
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import git
 import json
 import re
 import logging
+import mmap
+import tempfile
+from xml.etree import ElementTree
 
 # 导入 AutoGen v0.4 相关模块
 from autogen_core.models import SystemMessage, UserMessage
 from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
-from tree_sitter_language_pack import get_language, get_parser
+from tree_sitter import Parser
+from tree_sitter_language_pack import get_language
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 
 # 导入项目模块
 import minijules.indexing as indexing
 from minijules.types import TaskState
 
-from typing import TYPE_CHECKING, List, Dict
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
+
+# 可选依赖：安装了 google-re2 时，pytest 输出解析使用线性时间的 DFA 引擎，否则回退到标准库 re
+try:
+    import re2 as _pytest_re
+except ImportError:
+    _pytest_re = re
 
 if TYPE_CHECKING:
     # 避免循环导入
@@ -25,11 +45,19 @@ if TYPE_CHECKING:
 # --- 工具配置常量 ---
 GIT_AUTHOR_NAME = "MiniJules"
 GIT_AUTHOR_EMAIL = "minijules@agent.ai"
+# git 内置的空树对象，用于在仓库还没有任何提交时计算已暂存的变更
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
 
 ROOT_DIR = Path(__file__).parent.parent.resolve()
 WORKSPACE_DIR = Path(__file__).parent.resolve() / "workspace"
 WORKSPACE_DIR.mkdir(exist_ok=True)
 
+# 设置 MINIJULES_FAST_WRITES=1 时写文件跳过 fsync，以持久性换取速度
+FAST_WRITES = os.environ.get("MINIJULES_FAST_WRITES") == "1"
+
+# 超过该大小（字节）的源文件通过 mmap 流式解析
+MMAP_PARSE_THRESHOLD = 1024 * 1024
+
 logger = logging.getLogger(__name__)
 
 # --- 多语言配置中心 ---
@@ -43,66 +71,347 @@ def load_language_config():
         logging.error(f"错误: 无法加载或解析 language_config.json: {e}")
         return {}
 
-LANGUAGE_CONFIG = load_language_config()
+# 类主体节点的类型名中包含的子串
+BODY_NODE_SUBSTRINGS = ('body', 'block', 'declaration_list', 'field_declaration_list')
+
+@functools.lru_cache(maxsize=None)
+def _language_config() -> dict:
+    """
+    首次使用时才加载多语言配置，不涉及源代码的工具无需为此付出启动开销。
+    加载后为每种语言预先计算好结构分析中反复用到的节点类型集合。
+    """
+    config = load_language_config()
+    for lang_config in config.values():
+        lang_config["_func_types"] = frozenset(lang_config.get("function_node_types", []))
+        lang_config["_class_type"] = lang_config.get("class_node_type")
+        # 符号关键字的字节形式，用于在解析前快速排除不可能含有符号的文件
+        lang_config["_keyword_markers"] = tuple(m.encode('utf-8') for m in lang_config.get("symbol_markers", []))
+    return config
+
+@functools.lru_cache(maxsize=None)
+def _is_body_node_type(node_type: str) -> bool:
+    # 节点类型的种类有限，按类型名缓存子串匹配的结果
+    return any(substring in node_type for substring in BODY_NODE_SUBSTRINGS)
+
+def __getattr__(name):
+    # 保持 `tools.LANGUAGE_CONFIG` 的访问方式可用，同时延迟加载
+    if name == "LANGUAGE_CONFIG":
+        return _language_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- 辅助函数 ---
 
 def _get_safe_path(filepath: str) -> Path:
+    # 每次都重新解析并检查：工作区中的符号链接随时可能被 shell 或执行的代码替换，
+    # 这一安全检查的结果不能缓存
     absolute_filepath = (WORKSPACE_DIR / filepath).resolve()
     if WORKSPACE_DIR not in absolute_filepath.parents and absolute_filepath != WORKSPACE_DIR:
         raise ValueError(f"错误：路径 '{filepath}' 试图逃离允许的工作区。")
     return absolute_filepath
 
-def _get_ast(filepath: Path):
+@functools.lru_cache(maxsize=None)
+def _get_language(lang_name: str):
+    # 加载语法（Language）开销较大且对象只读，整个进程按语言只加载一次
+    return get_language(lang_name)
+
+# tree-sitter 的 Parser 不是线程安全的，因此每个线程各自缓存一份
+_parser_local = threading.local()
+
+def _get_thread_parser(lang_name: str):
+    parsers = getattr(_parser_local, "parsers", None)
+    if parsers is None:
+        parsers = _parser_local.parsers = {}
+    if lang_name not in parsers:
+        parsers[lang_name] = Parser(_get_language(lang_name))
+    return parsers[lang_name]
+
+def _atomic_write(path: Path, data: str, fast: Optional[bool] = None):
+    """
+    先写入同目录下的临时文件再原子地替换目标文件，避免写入中途崩溃导致文件损坏。
+    fast 为 True 时跳过 fsync；未指定时在调用时读取 FAST_WRITES。
+    """
+    if fast is None:
+        fast = FAST_WRITES
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    encoded = data.encode('utf-8')
+    # 与普通的 open() 一样以 0o666 创建，由 umask 决定新文件的最终权限
+    fd = os.open(str(tmp_path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            view = memoryview(encoded)
+            while view:
+                view = view[os.write(fd, view):]
+            if not fast:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if path.exists():
+            # 保留原文件的权限位（例如可执行脚本）
+            os.chmod(tmp_path, path.stat().st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def _get_ast(filepath: Path, content_bytes: Optional[bytes] = None):
     file_extension = filepath.suffix
-    if file_extension not in LANGUAGE_CONFIG:
+    language_config = _language_config()
+    if file_extension not in language_config:
         raise ValueError(f"不支持的文件类型: {file_extension}")
-    lang_config = LANGUAGE_CONFIG[file_extension]
+    lang_config = language_config[file_extension]
     lang_name = lang_config["language"]
-    parser = get_parser(lang_name)
-    content_bytes = filepath.read_bytes()
-    tree = parser.parse(content_bytes)
+    parser = _get_thread_parser(lang_name)
+    if content_bytes is not None or filepath.stat().st_size < MMAP_PARSE_THRESHOLD:
+        if content_bytes is None: content_bytes = filepath.read_bytes()
+        tree = parser.parse(content_bytes)
+        return tree, content_bytes, lang_config
+    # 大文件通过 mmap 按需读取，让 tree-sitter 直接从页缓存中拉取数据，避免整体复制到内存。
+    # 返回的 mmap 同样支持切片，调用方用完后需要将其关闭。
+    fd = os.open(str(filepath), os.O_RDONLY)
+    try:
+        content_bytes = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+    tree = parser.parse(lambda byte_offset, _point: content_bytes[byte_offset:byte_offset + 4096])
     return tree, content_bytes, lang_config
 
-def _get_node_name(node, node_type, lang_config):
+def _get_node_name(node, node_type, lang_config, content_bytes: bytes):
+    """返回节点名称的原始字节，直接从源码字节中切片，避免逐个节点解码。"""
+    name_node = None
     if lang_config["language"] == 'javascript' and node_type == 'variable_declarator':
-        name_node = node.child_by_field_name('name')
         value_node = node.child_by_field_name('value')
-        if name_node and value_node and value_node.type == 'arrow_function':
-            return name_node.text.decode('utf8')
-    elif node_type in lang_config.get("function_node_types", []) or node_type == lang_config.get("class_node_type"):
-         name_node = node.child_by_field_name("name")
-         if name_node: return name_node.text.decode('utf8')
+        if value_node and value_node.type == 'arrow_function':
+            name_node = node.child_by_field_name('name')
+    elif node_type in lang_config["_func_types"] or node_type == lang_config["_class_type"]:
+        name_node = node.child_by_field_name("name")
     elif node_type in ['type_spec', 'struct_item']:
         name_node = node.children[0] if node.children else None
-        if name_node: return name_node.text.decode('utf8')
+    if name_node:
+        return content_bytes[name_node.start_byte:name_node.end_byte]
     return None
 
-def _traverse_for_structure(node, lang_config, indent_level=1):
+def _find_body_node(node, lang_config):
+    body_node = next((c for c in node.children if _is_body_node_type(c.type)), None)
+    if not body_node and lang_config['language'] == 'go':
+         struct_type_node = next((c for c in node.children if c.type == 'struct_type'), None)
+         if struct_type_node: body_node = next((c for c in struct_type_node.children if c.type == 'field_declaration_list'), None)
+    return body_node
+
+# 按语言缓存编译好的结构查询，每种语言只编译一次
+_STRUCTURE_QUERIES = {}
+
+def _get_structure_query(lang_config):
+    lang_name = lang_config["language"]
+    if lang_name not in _STRUCTURE_QUERIES:
+        node_types = sorted(lang_config["_func_types"])
+        if lang_config["_class_type"]:
+            node_types.append(lang_config["_class_type"])
+        query_source = " ".join(f"({node_type}) @symbol" for node_type in node_types)
+        _STRUCTURE_QUERIES[lang_name] = _get_language(lang_name).query(query_source) if query_source else None
+    return _STRUCTURE_QUERIES[lang_name]
+
+def _collect_structure(tree, content_bytes: bytes, lang_config) -> List[bytes]:
+    """
+    使用 tree-sitter 查询一次性找出所有类和函数节点，再按文档顺序确定嵌套关系。
+    与逐节点递归遍历的语义一致：函数内部以及无名节点内部的符号不输出，
+    类只展开其主体中的符号，并逐层增加缩进。返回未解码的字节行。
+    """
+    query = _get_structure_query(lang_config)
+    if query is None:
+        return []
+    class_type = lang_config["_class_type"]
+    nodes = sorted(query.captures(tree.root_node).get("symbol", []), key=lambda n: (n.start_byte, -n.end_byte))
+
     structure_list = []
-    indent = "  " * indent_level
-    class_type = lang_config.get("class_node_type")
-    func_types = lang_config.get("function_node_types", [])
-    is_class = node.type == class_type
-    is_func = node.type in func_types
-    if is_class or is_func:
-        name = _get_node_name(node, node.type, lang_config)
+    # 栈中每一项为 (结束字节, 类主体的字节范围或 None, 缩进层级)；主体范围为 None 表示其内部不再展开
+    stack = []
+    for node in nodes:
+        while stack and stack[-1][0] <= node.start_byte:
+            stack.pop()
+        indent_level = 1
+        if stack:
+            _, body_range, parent_indent = stack[-1]
+            if body_range is None or not (body_range[0] <= node.start_byte and node.end_byte <= body_range[1]):
+                continue
+            indent_level = parent_indent + 1
+
+        name = _get_node_name(node, node.type, lang_config, content_bytes)
+        body_range = None
         if name:
-            node_kind = "class" if is_class else "def"
-            structure_list.append(f"{indent}{node_kind} {name}")
+            is_class = node.type == class_type
+            structure_list.append(b"  " * indent_level + (b"class " if is_class else b"def ") + name)
             if is_class:
-                body_node = next((c for c in node.children if 'body' in c.type or 'block' in c.type or 'declaration_list' in c.type or 'field_declaration_list' in c.type), None)
-                if not body_node and lang_config['language'] == 'go':
-                     struct_type_node = next((c for c in node.children if c.type == 'struct_type'), None)
-                     if struct_type_node: body_node = next((c for c in struct_type_node.children if c.type == 'field_declaration_list'), None)
-                if body_node:
-                    for child in body_node.children:
-                        structure_list.extend(_traverse_for_structure(child, lang_config, indent_level + 1))
-        return structure_list
-    for child in node.children:
-        structure_list.extend(_traverse_for_structure(child, lang_config, indent_level))
+                body_node = _find_body_node(node, lang_config)
+                if body_node: body_range = (body_node.start_byte, body_node.end_byte)
+        stack.append((node.end_byte, body_range, indent_level))
     return structure_list
 
+# 缓存的 git.Repo 句柄: (工作区路径, .git/HEAD 的 mtime, Repo)
+_repo_cache = None
+# 已经写入过提交者身份配置的仓库 git 目录
+_git_identity_configured = set()
+
+def _get_repo() -> git.Repo:
+    """
+    返回工作区的 git.Repo 句柄，在多次工具调用之间复用。
+    当工作区路径或 .git/HEAD 的 mtime 发生变化时（例如仓库被重新初始化）重新创建。
+    """
+    global _repo_cache
+    try:
+        head_mtime = (WORKSPACE_DIR / ".git" / "HEAD").stat().st_mtime
+    except OSError:
+        head_mtime = None
+    if _repo_cache is not None and head_mtime is not None:
+        cached_dir, cached_mtime, repo = _repo_cache
+        if cached_dir == WORKSPACE_DIR and cached_mtime == head_mtime:
+            return repo
+    repo = git.Repo(WORKSPACE_DIR)
+    _repo_cache = (WORKSPACE_DIR, head_mtime, repo) if head_mtime is not None else None
+    return repo
+
+# bash 中只读或由 bash 自行维护的变量，同步环境变量时跳过
+_BASH_RESERVED_VARS = frozenset({'BASHOPTS', 'SHELLOPTS', 'BASH_VERSINFO', 'EUID', 'PPID', 'UID', 'PWD', 'OLDPWD', 'SHLVL', '_'})
+_ENV_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+class _BashSession:
+    """
+    一个常驻的 bash 进程，避免每次工具调用都重新 fork/exec 一个 shell。
+    每条命令在独立的子 shell 中执行，`cd`、`set -e`、`exit` 等状态不会带入下一条命令；
+    执行前会把 os.environ 的变化同步到 bash，与每次新建进程时看到的环境一致。
+    命令的输出夹在唯一的起止哨兵行之间，返回码通过结束哨兵行传回。
+    """
+    def __init__(self):
+        self._process = None
+        self._stdout_queue = None
+        self._stderr_queue = None
+        self._env = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pump(stream, line_queue: queue.Queue):
+        # 在后台线程中持续读取输出，防止 stdout/stderr 任一管道写满导致死锁
+        for line in iter(stream.readline, ''):
+            line_queue.put(line)
+        line_queue.put(None)
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        self._process = subprocess.Popen(
+            ["bash"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, errors="replace", bufsize=1
+        )
+        self._env = dict(os.environ)
+        self._stdout_queue, self._stderr_queue = queue.Queue(), queue.Queue()
+        for stream, line_queue in ((self._process.stdout, self._stdout_queue), (self._process.stderr, self._stderr_queue)):
+            threading.Thread(target=self._pump, args=(stream, line_queue), daemon=True).start()
+
+    def _sync_env_script(self) -> str:
+        """生成把 bash 的环境变量同步为当前 os.environ 的脚本（只包含发生变化的变量）。"""
+        current = dict(os.environ)
+        lines = []
+        for name in self._env.keys() - current.keys():
+            if _ENV_NAME_RE.fullmatch(name) and name not in _BASH_RESERVED_VARS:
+                lines.append(f"unset {name}\n")
+        for name, value in current.items():
+            if self._env.get(name) != value and _ENV_NAME_RE.fullmatch(name) and name not in _BASH_RESERVED_VARS:
+                lines.append(f"export {name}={shlex.quote(value)} 2>/dev/null\n")
+        self._env = current
+        return "".join(lines)
+
+    @staticmethod
+    def _skip_until(line_queue: queue.Queue, marker: str) -> bool:
+        """丢弃标记行之前的所有行（例如上一条命令遗留的后台任务输出）。进程退出时返回 False。"""
+        while True:
+            line = line_queue.get()
+            if line is None:
+                return False
+            if line.rstrip("\n") == marker:
+                return True
+
+    @staticmethod
+    def _read_until(line_queue: queue.Queue, sentinel: str, on_line=None) -> Tuple[str, str]:
+        """
+        读取输出直到哨兵行，返回 (输出, 哨兵行的剩余部分)。进程退出时剩余部分为 None。
+        如果提供了 on_line，每读到一行就立即回调一次。
+        """
+        lines = []
+        while True:
+            line = line_queue.get()
+            if line is None:
+                return "".join(lines), None
+            if line.startswith(sentinel):
+                # 去掉哨兵前为保证其独占一行而额外打印的换行符
+                return "".join(lines)[:-1], line[len(sentinel):].strip()
+            lines.append(line)
+            if on_line: on_line(line)
+
+    def run(self, command: str, cwd: Path, on_stdout_line=None) -> Tuple[str, str, int]:
+        """在常驻 bash 中执行命令，返回 (stdout, stderr, 返回码)。stdout 可通过 on_stdout_line 逐行流式消费。"""
+        with self._lock:
+            self._ensure_started()
+            token = uuid.uuid4().hex
+            start_marker, sentinel = f"__MINIJULES_START_{token}__", f"__MINIJULES_END_{token}__"
+            # 在子 shell 中通过 eval 执行：语法错误不会吞掉后续的哨兵行，shell 状态也不会残留；
+            # stdin 重定向到 /dev/null，防止命令读取到协议数据。
+            script = (
+                self._sync_env_script() +
+                f"printf '\\n{start_marker}\\n'; printf '\\n{start_marker}\\n' >&2\n"
+                f"( cd {shlex.quote(str(cwd))} && eval {shlex.quote(command)} ) < /dev/null\n"
+                f"__minijules_rc=$?\n"
+                f"printf '\\n{sentinel}%d\\n' \"$__minijules_rc\"\n"
+                f"printf '\\n{sentinel}\\n' >&2\n"
+            )
+            try:
+                self._process.stdin.write(script)
+                self._process.stdin.flush()
+            except BrokenPipeError:
+                self._process.wait()
+                return "", "bash 会话意外终止。", self._process.returncode
+
+            # 起始哨兵之前的内容来自之前命令遗留的后台任务，直接丢弃
+            if self._skip_until(self._stdout_queue, start_marker) and self._skip_until(self._stderr_queue, start_marker):
+                stdout, rc = self._read_until(self._stdout_queue, sentinel, on_stdout_line)
+                stderr, _ = self._read_until(self._stderr_queue, sentinel)
+            else:
+                stdout, stderr, rc = "", "", None
+            if rc is None:
+                # bash 进程本身意外退出（例如被信号终止），下一次调用时会自动重启
+                return stdout, stderr, self._process.wait()
+            return stdout, stderr, int(rc)
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                self._process.wait()
+            self._process = None
+
+_bash_session = _BashSession()
+atexit.register(_bash_session.close)
+
+# 扫描工作区时跳过的目录，这些目录通常很大且不包含需要分析的源代码
+IGNORED_DIR_NAMES = {'.git', 'node_modules', '__pycache__'}
+
+def _iter_source_files(directory: Path = None):
+    """
+    按路径顺序递归地产出工作区中受支持语言的源文件。
+    每个目录的条目在本地排序，因此无需对全部结果做一次全局排序，
+    同时会剪除 IGNORED_DIR_NAMES 中的目录，避免遍历 .git 等大目录。
+    """
+    directory = WORKSPACE_DIR if directory is None else directory
+    language_config = _language_config()
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name not in IGNORED_DIR_NAMES:
+                yield from _iter_source_files(Path(entry.path))
+        elif os.path.splitext(entry.name)[1] in language_config and entry.is_file():
+            yield Path(entry.path)
+
 # --- Agent 可用工具 ---
 
 def google_search(query: str) -> str:
@@ -199,14 +508,11 @@ def detect_project_language() -> str:
     extension_counts = {}
 
     # 映射文件扩展名到我们在 language_config.json 中定义的语言名称
-    lang_map = {ext: config['language'] for ext, config in LANGUAGE_CONFIG.items()}
+    lang_map = {ext: config['language'] for ext, config in _language_config().items()}
 
-    for file_path in WORKSPACE_DIR.rglob('*'):
-        if file_path.is_file():
-            ext = file_path.suffix
-            if ext in lang_map:
-                lang = lang_map[ext]
-                extension_counts[lang] = extension_counts.get(lang, 0) + 1
+    for file_path in _iter_source_files():
+        lang = lang_map[file_path.suffix]
+        extension_counts[lang] = extension_counts.get(lang, 0) + 1
 
     if not extension_counts:
         logger.warning("在工作区中未找到受支持的语言文件。")
@@ -218,24 +524,38 @@ def detect_project_language() -> str:
     return dominant_language
 
 
+def _parse_file_structure(file_path: Path) -> List[str]:
+    """解析单个文件，返回其在项目结构中的输出行。"""
+    lines = [f"📁 {file_path.relative_to(WORKSPACE_DIR)}"]
+    try:
+        content_bytes = None
+        markers = _language_config()[file_path.suffix]["_keyword_markers"]
+        if markers and file_path.stat().st_size < MMAP_PARSE_THRESHOLD:
+            # 小文件整体读入后先做关键字预筛，没有任何关键字的文件不可能含有符号，直接跳过解析
+            content_bytes = file_path.read_bytes()
+            if not any(marker in content_bytes for marker in markers): return lines
+        tree, content_bytes, lang_config = _get_ast(file_path, content_bytes)
+        try:
+            symbols = _collect_structure(tree, content_bytes, lang_config)
+        finally:
+            if isinstance(content_bytes, mmap.mmap): content_bytes.close()
+        # 每个文件只解码一次
+        if symbols: lines.append(b"\n".join(symbols).decode('utf-8'))
+    except Exception as e:
+        lines.append(f"  (Error parsing file: {e})")
+    return lines
+
 def list_project_structure() -> str:
     """
     递归扫描工作区，解析所有支持的文件，并返回所有类、函数和方法的树状结构。
     """
     try:
         output_lines = ["Project Structure:"]
-        for file_path in sorted(WORKSPACE_DIR.rglob('*')):
-            if not file_path.is_file() or file_path.suffix not in LANGUAGE_CONFIG:
-                continue
-            relative_path = file_path.relative_to(WORKSPACE_DIR)
-            output_lines.append(f"📁 {relative_path}")
-            try:
-                tree, _, lang_config = _get_ast(file_path)
-                for node in tree.root_node.children:
-                    symbols = _traverse_for_structure(node, lang_config)
-                    output_lines.extend(symbols)
-            except Exception as e:
-                output_lines.append(f"  (Error parsing file: {e})")
+        paths = list(_iter_source_files())
+        # 文件读取和 tree-sitter 解析都适合多线程；map 按输入顺序返回，保持输出有序
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for file_lines in executor.map(_parse_file_structure, paths):
+                output_lines.extend(file_lines)
         result = "\n".join(output_lines)
         return result if len(output_lines) > 1 else "No supported files found."
     except Exception as e:
@@ -267,7 +587,7 @@ def create_file_with_block(filepath: str, content: str) -> str:
         if safe_path.exists():
             return f"错误: 文件 '{filepath}' 已存在。请使用 'overwrite_file_with_block' 或 'replace_with_git_merge_diff' 进行修改。"
         safe_path.parent.mkdir(parents=True, exist_ok=True)
-        safe_path.write_text(content, encoding='utf-8')
+        _atomic_write(safe_path, content)
         return f"文件 '{filepath}' 已成功创建。"
     except Exception as e:
         return f"创建文件时发生意外错误: {e}"
@@ -280,12 +600,14 @@ def overwrite_file_with_block(filepath: str, content: str) -> str:
     try:
         safe_path = _get_safe_path(filepath)
         safe_path.parent.mkdir(parents=True, exist_ok=True)
-        safe_path.write_text(content, encoding='utf-8')
+        _atomic_write(safe_path, content)
         return f"文件 '{filepath}' 已被成功覆盖。"
     except Exception as e:
         return f"覆盖文件时发生意外错误: {e}"
 overwrite_file_with_block.is_dangerous = True
 
+_MERGE_DIFF_RE = re.compile(r'<<<<<<< SEARCH\n(.*?)\n=======\n(.*?)\n>>>>>>> REPLACE', re.DOTALL)
+
 def replace_with_git_merge_diff(filepath: str, content: str) -> str:
     """
     对现有文件执行搜索和替换操作。
@@ -305,20 +627,20 @@ def replace_with_git_merge_diff(filepath: str, content: str) -> str:
         original_content = safe_path.read_text(encoding='utf-8')
 
         # 解析搜索和替换块
-        match = re.search(r'<<<<<<< SEARCH\n(.*?)\n=======\n(.*?)\n>>>>>>> REPLACE', content, re.DOTALL)
+        match = _MERGE_DIFF_RE.search(content)
         if not match:
             return "错误: 输入内容未使用正确的 'SEARCH/REPLACE' 格式。"
 
         search_block = match.group(1)
         replace_block = match.group(2)
 
-        # 使用 re.sub 来确保只替换一次，并处理可能存在的特殊字符
-        new_content, num_replacements = re.subn(re.escape(search_block), replace_block, original_content, count=1)
-
-        if num_replacements == 0:
+        # 按字面量查找并只替换第一次出现的位置，无需构造正则
+        idx = original_content.find(search_block)
+        if idx == -1:
             return f"错误: 'SEARCH' 块在文件 '{filepath}' 中未找到。"
+        new_content = original_content[:idx] + replace_block + original_content[idx + len(search_block):]
 
-        safe_path.write_text(new_content, encoding='utf-8')
+        _atomic_write(safe_path, new_content)
 
         return f"文件 '{filepath}' 已成功更新。"
     except Exception as e:
@@ -358,7 +680,6 @@ def grep(pattern: str) -> str:
     try:
         # 使用 -r (递归) 和 -n (行号) 标志进行搜索
         # 使用 shlex.quote 来安全地处理用户输入的模式
-        import shlex
         quoted_pattern = shlex.quote(pattern)
         command = f"grep -rn {quoted_pattern} ."
 
@@ -374,25 +695,140 @@ def grep(pattern: str) -> str:
     except Exception as e:
         return f"执行 grep 时发生意外错误: {e}"
 
+def _format_bash_output(stdout: str, stderr: str, returncode: int) -> str:
+    output = f"STDOUT:\n{stdout}\n" if stdout else ""
+    output += f"STDERR:\n{stderr}\n" if stderr else ""
+    output += f"返回码: {returncode}"
+    return output
+
 def run_in_bash_session(command: str) -> str:
     """在 bash 会话中运行命令。"""
     try:
-        result = subprocess.run(command, shell=True, cwd=WORKSPACE_DIR, capture_output=True, text=True, check=False)
-        output = f"STDOUT:\n{result.stdout}\n" if result.stdout else ""
-        output += f"STDERR:\n{result.stderr}\n" if result.stderr else ""
-        output += f"返回码: {result.returncode}"
-        return output
+        return _format_bash_output(*_bash_session.run(command, WORKSPACE_DIR))
     except Exception as e: return f"运行命令时发生意外错误: {e}"
 run_in_bash_session.is_dangerous = True
 
+_HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def _parse_unified_hunks(patch_content: str) -> Optional[List[Tuple[int, int, List[str], List[str], int, int]]]:
+    """
+    将单文件的统一差异格式补丁解析为 (旧起始行, 旧行数, 旧行列表, 新行列表, 前导上下文行数, 尾随上下文行数) 的列表。
+    遇到多文件、二进制、"\\ No newline" 标记或行数与 hunk 头不符等不常见的情况时返回 None，
+    交由 `patch` 命令处理。
+    """
+    hunks = []
+    lines = patch_content.splitlines()
+    i, file_headers = 0, 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- "):
+            file_headers += 1
+            if file_headers > 1:
+                return None
+        elif line.startswith("GIT binary patch") or line.startswith("Binary files"):
+            return None
+        elif line.startswith("@@"):
+            match = _HUNK_HEADER_RE.match(line)
+            if not match:
+                return None
+            old_start = int(match.group(1))
+            old_count = int(match.group(2)) if match.group(2) is not None else 1
+            new_count = int(match.group(4)) if match.group(4) is not None else 1
+            old_lines, new_lines, tags = [], [], []
+            i += 1
+            while (len(old_lines) < old_count or len(new_lines) < new_count) and i < len(lines):
+                hunk_line = lines[i]
+                # 空行按空白上下文行处理（手写补丁中常见）
+                tag, text = (hunk_line[:1] or " "), hunk_line[1:]
+                if tag == " ":
+                    old_lines.append(text)
+                    new_lines.append(text)
+                elif tag == "-":
+                    old_lines.append(text)
+                elif tag == "+":
+                    new_lines.append(text)
+                else:
+                    return None
+                tags.append(tag)
+                i += 1
+            if len(old_lines) != old_count or len(new_lines) != new_count:
+                return None
+            if i < len(lines) and lines[i].startswith("\\"):
+                return None
+            leading = next((n for n, tag in enumerate(tags) if tag != " "), len(tags))
+            trailing = next((n for n, tag in enumerate(reversed(tags)) if tag != " "), len(tags))
+            hunks.append((old_start, old_count, old_lines, new_lines, leading, trailing))
+            continue
+        i += 1
+    return hunks or None
+
+def _locate_hunk(file_lines, old_lines, leading, trailing, old_start, expected, cursor, last_start) -> Optional[int]:
+    """
+    按 `patch` 的规则在 file_lines 中定位 hunk（不使用模糊匹配），返回起始下标，找不到时返回 None。
+    前导上下文少于尾随上下文的 hunk 若位于文件开头只能匹配文件开头，尾随上下文较少的只能匹配文件末尾；
+    其余情况从期望位置向两侧搜索，距离相同时与 `patch` 一样优先选择靠后的位置。
+    """
+    if leading < trailing and old_start <= 1:
+        candidates = [0] if cursor == 0 else []
+    elif trailing < leading:
+        candidates = [last_start] if last_start >= cursor else []
+    else:
+        candidates = sorted(range(cursor, last_start + 1), key=lambda pos: (abs(pos - expected), pos < expected))
+    return next((pos for pos in candidates if file_lines[pos:pos + len(old_lines)] == old_lines), None)
+
+def _apply_unified_diff(original: str, patch_content: str) -> Optional[str]:
+    """
+    在进程内应用简单的统一差异格式补丁，返回应用后的文本。
+    只接受每个 hunk 的上下文都能逐字匹配的情况（允许像 `patch` 一样存在行偏移），
+    其余情况返回 None，由调用方回退到 `patch` 命令，以保持其模糊匹配和报错行为。
+    """
+    if "\r" in original:
+        return None
+    hunks = _parse_unified_hunks(patch_content)
+    if hunks is None:
+        return None
+    file_lines = original.split("\n")
+    has_trailing_newline = file_lines[-1] == ""
+    if has_trailing_newline:
+        file_lines.pop()
+
+    result, cursor, offset = [], 0, 0
+    for old_start, old_count, old_lines, new_lines, leading, trailing in hunks:
+        # old_count 为 0 时补丁表示在第 old_start 行之后插入
+        expected = (old_start if old_count == 0 else old_start - 1) + offset
+        last_start = len(file_lines) - len(old_lines)
+        position = _locate_hunk(file_lines, old_lines, leading, trailing, old_start, expected, cursor, last_start)
+        if position is None:
+            return None
+        # 不带换行符的末行被改动时，行尾语义需要 `patch` 的完整处理
+        if not has_trailing_newline and old_lines and position + len(old_lines) == len(file_lines):
+            return None
+        result.extend(file_lines[cursor:position])
+        result.extend(new_lines)
+        cursor = position + len(old_lines)
+        offset = position - (expected - offset)
+    result.extend(file_lines[cursor:])
+    return "\n".join(result) + ("\n" if has_trailing_newline and result else "")
+
 def apply_patch(filename: str, patch_content: str) -> str:
     """应用一个补丁。"""
     try:
         safe_path = _get_safe_path(filename)
         if not safe_path.is_file(): return f"错误: 文件 '{filename}' 不存在。"
-        result = subprocess.run(["patch", str(safe_path)], input=patch_content, text=True, capture_output=True, cwd=WORKSPACE_DIR, check=False)
-        if result.returncode != 0:
-            return f"应用补丁失败 (返回码: {result.returncode}):\nSTDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}"
+        # 简单补丁直接在进程内应用，省去启动 shell 和 `patch` 子进程的开销
+        try:
+            patched = _apply_unified_diff(safe_path.read_bytes().decode('utf-8'), patch_content)
+        except UnicodeDecodeError:
+            patched = None
+        if patched is not None:
+            _atomic_write(safe_path, patched)
+            return f"补丁已成功应用于 '{filename}'。"
+        delimiter = f"MINIJULES_PATCH_{uuid.uuid4().hex}"
+        if not patch_content.endswith("\n"): patch_content += "\n"
+        command = f"patch {shlex.quote(str(safe_path))} <<'{delimiter}'\n{patch_content}{delimiter}"
+        stdout, stderr, returncode = _bash_session.run(command, WORKSPACE_DIR)
+        if returncode != 0:
+            return f"应用补丁失败 (返回码: {returncode}):\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
         return f"补丁已成功应用于 '{filename}'。"
     except Exception as e: return f"应用补丁时发生意外错误: {e}"
 apply_patch.is_dangerous = True
@@ -400,34 +836,87 @@ apply_patch.is_dangerous = True
 def git_status() -> str:
     """获取 git 状态。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
+        repo = _get_repo()
         return f"Git Status:\n{repo.git.status()}"
     except Exception as e: return f"获取 Git 状态时发生意外错误: {e}"
 
+def _format_diffs(diffs) -> str:
+    """
+    将 GitPython 的 Diff 对象格式化为统一差异格式文本，包含重命名、文件模式和二进制文件的头部信息。
+    与 `git diff` 的区别是不输出 `index` 和 `similarity index` 行。
+    """
+    parts = []
+    for d in diffs:
+        a_path, b_path = d.a_path or d.b_path, d.b_path or d.a_path
+        parts.append(f"diff --git a/{a_path} b/{b_path}")
+        if d.new_file:
+            parts.append(f"new file mode {(d.b_mode or d.a_mode):o}")
+        elif d.deleted_file:
+            parts.append(f"deleted file mode {(d.a_mode or d.b_mode):o}")
+        elif d.a_mode and d.b_mode and d.a_mode != d.b_mode:
+            parts.append(f"old mode {d.a_mode:o}")
+            parts.append(f"new mode {d.b_mode:o}")
+        if d.renamed_file:
+            parts.append(f"rename from {d.rename_from}")
+            parts.append(f"rename to {d.rename_to}")
+        # 与 git 一致，没有文本内容变更（纯重命名、仅模式变化）或二进制文件时不输出 ---/+++ 行
+        if d.diff and not d.diff.startswith(b"Binary files"):
+            parts.append(f"--- a/{d.a_path}" if d.a_path and not d.new_file else "--- /dev/null")
+            parts.append(f"+++ b/{d.b_path}" if d.b_path and not d.deleted_file else "+++ /dev/null")
+        if d.diff:
+            parts.append(d.diff.decode('utf-8', 'replace').rstrip("\n"))
+    return "\n".join(parts)
+
 def git_diff(filepath: str = None) -> str:
     """获取 git diff。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
-        diff = repo.git.diff(filepath)
-        if not diff: diff = repo.git.diff('--staged', filepath)
-        return f"Git Diff:\n{diff}" if diff else "无变更。"
+        repo = _get_repo()
+        paths = [filepath] if filepath else None
+        # 优先返回未暂存的变更；只有在没有未暂存变更时才计算已暂存的变更
+        diffs = repo.index.diff(None, paths=paths, create_patch=True)
+        if not diffs:
+            # index.diff("HEAD") 默认方向为 索引 -> HEAD，R=True 使其与 `git diff --staged` 一致；
+            # 还没有提交时与空树比较，和 `git diff --staged` 一样列出所有已暂存的文件
+            base = "HEAD" if repo.head.is_valid() else repo.tree(EMPTY_TREE_SHA)
+            diffs = repo.index.diff(base, paths=paths, create_patch=True, R=True)
+        return f"Git Diff:\n{_format_diffs(diffs)}" if diffs else "无变更。"
     except Exception as e: return f"获取 Git diff 时发生意外错误: {e}"
 
+def _stage_paths(repo: git.Repo, filepaths: List[str]):
+    """
+    使用相对于工作区的路径，通过一次 `git add` 暂存所有文件。
+    交给 git 命令处理以遵守 .gitignore 并拒绝 .git/ 内部文件（`repo.index.add` 两者都不检查）。
+    """
+    relative_paths = [str(_get_safe_path(filepath).relative_to(WORKSPACE_DIR)) for filepath in filepaths]
+    repo.git.add('--', *relative_paths)
+
 def git_add(filepath: str) -> str:
     """git add 一个文件。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
-        repo.git.add(str(_get_safe_path(filepath)))
+        _stage_paths(_get_repo(), [filepath])
         return f"文件 '{filepath}' 已成功添加到暂存区。"
     except Exception as e: return f"Git add 操作失败: {e}"
 git_add.is_dangerous = True
 
+# New function added by MiniJules
+def git_add_many(filepaths: List[str]) -> str:
+    """一次性 git add 多个文件，只写入一次索引。"""
+    try:
+        _stage_paths(_get_repo(), filepaths)
+        return f"{len(filepaths)} 个文件已成功添加到暂存区。"
+    except Exception as e: return f"Git add 操作失败: {e}"
+git_add_many.is_dangerous = True
+
 def git_commit(message: str) -> str:
     """git commit。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
-        repo.config_writer().set_value("user", "name", GIT_AUTHOR_NAME).release()
-        repo.config_writer().set_value("user", "email", GIT_AUTHOR_EMAIL).release()
+        repo = _get_repo()
+        # 提交者身份每个仓库只需配置一次
+        if repo.git_dir not in _git_identity_configured:
+            with repo.config_writer() as cw:
+                cw.set_value("user", "name", GIT_AUTHOR_NAME)
+                cw.set_value("user", "email", GIT_AUTHOR_EMAIL)
+            _git_identity_configured.add(repo.git_dir)
         return f"成功提交变更:\n{repo.git.commit(m=message)}"
     except Exception as e: return f"Git commit 操作失败: {e}"
 git_commit.is_dangerous = True
@@ -435,7 +924,7 @@ git_commit.is_dangerous = True
 def git_create_branch(branch_name: str) -> str:
     """创建 git 分支。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
+        repo = _get_repo()
         new_branch = repo.create_head(branch_name)
         new_branch.checkout()
         return f"已成功创建并切换到新分支: '{branch_name}'。"
@@ -447,7 +936,7 @@ def restore_file(filepath: str) -> str:
     """将指定文件恢复到任务开始时的状态。"""
     try:
         safe_path = _get_safe_path(filepath)
-        repo = git.Repo(WORKSPACE_DIR)
+        repo = _get_repo()
 
         # 检查标签是否存在
         tag_name = "minijules-initial-state"
@@ -464,7 +953,7 @@ restore_file.is_dangerous = True
 def reset_all() -> str:
     """将整个工作区恢复到任务开始时的状态。"""
     try:
-        repo = git.Repo(WORKSPACE_DIR)
+        repo = _get_repo()
 
         # 检查标签是否存在
         tag_name = "minijules-initial-state"
@@ -481,47 +970,261 @@ def reset_all() -> str:
 reset_all.is_dangerous = True
 
 
+# 预编译的 pytest 输出解析正则，在模块加载时编译一次
+# 模式均锚定在行首，避免在不可能匹配的位置反复尝试；标题名使用贪婪匹配，
+# 回溯只发生在行尾的下划线处，而不是对名称中的每个位置都尝试一次结尾模式
+_HEADER_RE = _pytest_re.compile(r"^_{10,}\s(.+)\s_{10,}$")
+# 失败块中的回溯位置行与 `E ...` 摘要行合并为一个带命名分组的交替模式，每行只匹配一次。
+# 位置行既可以是默认长格式的 `path:line: XxxError`，也可以是 `--tb=short` 格式的 `path:line: in func`
+_BLOCK_LINE_RE = _pytest_re.compile(
+    r"^(?:(?P<tb_path>\S+?\.py):(?P<tb_line>\d{1,7}):\s(?:(?P<tb_type>\w+Error)|in\s)"
+    r"|E\s+(?:(?P<err_type>\w+Error):\s)?(?P<err_msg>.*)$)"
+)
+
+def _build_failure(test_name: str, block_lines: List[str]):
+    """根据一个失败/错误块的内容构建失败信息字典，无法定位错误时返回 None。"""
+    trace_match = frame_match = summary_match = None
+    # 单次遍历块内各行；先用廉价的子串检查筛选候选行，只有可能匹配的行才交给正则
+    for line in block_lines:
+        if ".py:" not in line and not line.startswith("E"):
+            continue
+        match = _BLOCK_LINE_RE.match(line)
+        if match is None:
+            continue
+        if match.group("tb_type") is not None:
+            trace_match = trace_match or match
+        elif match.group("tb_path") is not None:
+            # 短格式中每一帧占一行，最后一帧即异常抛出的位置
+            frame_match = match
+        else:
+            summary_match = summary_match or match
+        if trace_match and summary_match:
+            break
+    if trace_match:
+        filepath, lineno, error_type = trace_match.group("tb_path", "tb_line", "tb_type")
+    elif frame_match:
+        filepath, lineno = frame_match.group("tb_path", "tb_line")
+        # 短格式不单独给出异常类型，从 E 行中读取；裸 assert 的 E 行不带类型
+        error_type = summary_match and summary_match.group("err_type")
+        if not error_type:
+            is_assert = summary_match and summary_match.group("err_msg").startswith("assert")
+            error_type = "AssertionError" if is_assert else "Exception"
+    else:
+        return None
+    block_content = "\n".join(block_lines)
+
+    # Extract the summary line for a more descriptive error message. Handles cases where pytest omits the error type for brevity (e.g., AssertionError).
+    error_message = summary_match.group("err_msg").strip() if summary_match else "No specific error message found."
+
+    return {
+        "test_name": test_name.strip(),
+        "filepath": filepath,
+        "line_number": int(lineno),
+        "error_type": error_type,
+        "error_message": error_message,
+        "full_traceback": block_content.strip()
+    }
+
+class _PytestOutputParser:
+    """
+    增量式的 pytest 输出解析器，可以在测试仍在运行时逐行喂入输出。
+    遇到 `____ name ____` 标题行时开始收集一个块，遇到下一个 `____` 或 `====`
+    分隔行时该块即告结束并立即生成失败信息，因此只需保留当前块的内容。
+    """
+    def __init__(self):
+        self.failures = []
+        self._test_name = None
+        self._block_lines = []
+
+    def _flush(self):
+        if self._test_name is not None:
+            failure = _build_failure(self._test_name, self._block_lines)
+            if failure: self.failures.append(failure)
+        self._test_name, self._block_lines = None, []
+
+    def _start_block(self, line: str):
+        self._flush()
+        header = _HEADER_RE.match(line)
+        self._test_name = header.group(1) if header else None
+
+    def _end_block(self, line: str):
+        self._flush()
+
+    # 分隔行按行首 10 个字符分派，每行只做一次哈希查找；`====` 分节行只结束当前块，不可能是块标题
+    _LINE_HANDLERS = {"_" * 10: _start_block, "=" * 10: _end_block}
+
+    def feed(self, line: str):
+        line = line.rstrip("\r\n")
+        handler = self._LINE_HANDLERS.get(line[:10])
+        if handler is not None:
+            handler(self, line)
+        elif self._test_name is not None:
+            self._block_lines.append(line)
+
+    def close(self) -> list[dict[str, any]]:
+        self._flush()
+        return self.failures
+
 def _parse_pytest_output(output: str) -> list[dict[str, any]]:
     """
     解析 pytest 的输出，提取失败和错误信息。
     """
+    parser = _PytestOutputParser()
+    for line in output.splitlines():
+        parser.feed(line)
+    return parser.close()
+
+def _is_pytest_command(command: str) -> bool:
+    """判断命令是否为单条 pytest 调用，只有这种情况才能安全地追加报告参数。"""
+    if any(op in command for op in (";", "&", "|", "\n")):
+        return False
+    return any(token == "pytest" or token.endswith("/pytest") for token in command.split())
+
+def _junit_test_name(testcase) -> str:
+    """
+    按 pytest 文本输出的格式还原用例名，例如类中的用例为 "TestK.test_m"。
+    报告使用 xunit1 格式，classname 由模块路径（与 file 属性对应）加上类名组成，去掉模块部分即可。
+    """
+    name = testcase.get("name", "")
+    classname, file_path = testcase.get("classname", ""), testcase.get("file", "")
+    module = file_path[:-len(".py")].replace("/", ".") if file_path.endswith(".py") else ""
+    if module and classname.startswith(module + "."):
+        return f"{classname[len(module) + 1:]}.{name}"
+    return name
+
+def _parse_junit_report(report_path: Path) -> list[dict[str, any]]:
+    """
+    从 pytest 生成的 JUnit XML 报告中提取失败和错误信息。
+    每个用例的结果已经是结构化的，只需在其回溯文本中定位出错位置。
+    """
     failures = []
-    # Regex to find the detailed failure/error blocks. The lookahead group is made non-capturing.
-    failure_blocks = re.findall(r"_{10,}\s(.*?)\s_{10,}([\s\S]*?)(?=(?:\n_{10,}|\n={10,}))", output)
-
-    for test_name, block_content in failure_blocks:
-        # Regex to find file path, line number, and error type in the traceback
-        match = re.search(r"(\S+\.py):(\d+):\s(\w+Error)", block_content)
-        if match:
-            filepath, lineno, error_type = match.groups()
-
-            # Extract the summary line for a more descriptive error message. Handles cases where pytest omits the error type for brevity (e.g., AssertionError).
-            summary_match = re.search(r"E\s+(?:\w+Error: )?(.*)", block_content, re.MULTILINE)
-            error_message = summary_match.group(1).strip() if summary_match else "No specific error message found."
-
-            failures.append({
-                "test_name": test_name.strip(),
-                "filepath": filepath,
-                "line_number": int(lineno),
-                "error_type": error_type,
-                "error_message": error_message,
-                "full_traceback": block_content.strip()
-            })
-
+    for testcase in ElementTree.parse(report_path).getroot().iter("testcase"):
+        for result in testcase:
+            if result.tag not in ("failure", "error"):
+                continue
+            test_name = _junit_test_name(testcase)
+            message = result.get("message", "")
+            if result.tag == "error" and message == "collection failure":
+                # 与文本输出保持一致，例如 "ERROR collecting test_b.py"
+                test_name = f"ERROR collecting {testcase.get('file') or test_name}"
+            elif result.tag == "error" and message.startswith("failed on "):
+                # 与文本输出保持一致，例如 "ERROR at setup of test_x"
+                test_name = f"ERROR at {message.split()[2]} of {test_name}"
+            failure = _build_failure(test_name, (result.text or "").splitlines())
+            if failure: failures.append(failure)
     return failures
 
-
-async def _generate_fix_patch(
-    failure_details: dict,
-    file_content: str,
-    client: OpenAIChatCompletionClient
-) -> str:
+def _run_and_parse_streaming(command: str) -> Tuple[str, list[dict[str, any]]]:
     """
-    使用 LLM 生成一个用于修复代码的补丁。
+    运行测试命令并提取其中的失败信息。
+    对 pytest 命令追加 `--junitxml`，直接从结构化报告中读取失败；
+    其他命令在输出产生的同时逐行解析文本，报告未能生成时则退回到解析完整输出。
+    返回与 `run_in_bash_session` 格式相同的输出字符串，以及解析出的失败列表。
     """
-    logger.info("开始生成修复补丁...")
-
-    system_prompt = """
+    parser = _PytestOutputParser()
+    report_path = None
+    if _is_pytest_command(command):
+        report_path = Path(tempfile.gettempdir()) / f"minijules-report-{uuid.uuid4().hex}.xml"
+        # 短格式回溯只保留每一帧的位置和源码行，解析和随后发给 LLM 的文本都小得多
+        if "--tb" not in command: command += " --tb=short --no-header"
+        # xunit1 格式的报告带有 file 属性，用于从 classname 中还原类名
+        command = f"{command} -o junit_family=xunit1 --junitxml={shlex.quote(str(report_path))}"
+    try:
+        stdout, stderr, returncode = _bash_session.run(
+            command, WORKSPACE_DIR, on_stdout_line=None if report_path else parser.feed
+        )
+    except Exception as e:
+        if report_path is not None: report_path.unlink(missing_ok=True)
+        return f"运行命令时发生意外错误: {e}", []
+    if report_path is None:
+        failures = parser.close()
+    else:
+        try:
+            failures = _parse_junit_report(report_path)
+        except (OSError, ElementTree.ParseError):
+            # 例如命令行参数错误时 pytest 不会生成报告，退回到解析文本输出
+            failures = _parse_pytest_output(stdout)
+        finally:
+            report_path.unlink(missing_ok=True)
+        # 报告文件已被删除，去掉 pytest 输出中指向它的提示行
+        stdout = "\n".join(line for line in stdout.split("\n")
+                           if not ("generated xml file:" in line and str(report_path) in line))
+    return _format_bash_output(stdout, stderr, returncode), failures
+
+
+# 用于定位断言语句的 tree-sitter 查询，首次使用时编译
+_ASSERT_QUERY = None
+
+# 本地修复只写回较短的标量字面量；更长的值可能已被 pytest 截断，交给 LLM 处理
+LOCAL_FIX_MAX_LITERAL_LEN = 80
+_LOCAL_FIX_SCALAR_TYPES = (int, float, complex, str, bytes, type(None))
+
+def _get_assert_query():
+    global _ASSERT_QUERY
+    if _ASSERT_QUERY is None:
+        _ASSERT_QUERY = _get_language("python").query("(assert_statement) @assert")
+    return _ASSERT_QUERY
+
+def _apply_local_fix(failure_details: dict, file_content: str):
+    """
+    尝试在本地为简单的失败直接修正源码，无需调用 LLM。
+    目前支持的情形: pytest 报告 `assert X == Y`，且源码中对应断言的右侧是与 Y 相等的字面量，
+    此时将右侧替换为实际值 X。返回修正后的内容，无法处理时返回 None。
+    X 只接受较短的标量字面量：pytest 会用 `...` 截断较长的值，截断后的内容不能写回源码。
+    """
+    if failure_details['error_type'] != 'AssertionError' or not failure_details['filepath'].endswith('.py'):
+        return None
+    if '...' in failure_details['error_message']:
+        return None
+    try:
+        reported = ast.parse(failure_details['error_message'].strip()).body[0]
+        if not (isinstance(reported, ast.Assert) and isinstance(reported.test, ast.Compare)
+                and len(reported.test.ops) == 1 and isinstance(reported.test.ops[0], ast.Eq)):
+            return None
+        actual = ast.literal_eval(reported.test.left)
+        expected = ast.literal_eval(reported.test.comparators[0])
+        if (not isinstance(actual, _LOCAL_FIX_SCALAR_TYPES)
+                or len(repr(actual)) > LOCAL_FIX_MAX_LITERAL_LEN):
+            return None
+
+        content_bytes = file_content.encode('utf-8')
+        tree = _get_thread_parser("python").parse(content_bytes)
+        target_row = failure_details['line_number'] - 1
+        assert_node = next((n for n in _get_assert_query().captures(tree.root_node).get("assert", [])
+                            if n.start_point[0] <= target_row <= n.end_point[0]), None)
+        comparison = assert_node.named_children[0] if assert_node and assert_node.named_children else None
+        if comparison is None or comparison.type != 'comparison_operator' or len(comparison.named_children) != 2:
+            return None
+        if [c.type for c in comparison.children if not c.is_named] != ['==']:
+            return None
+        rhs = comparison.named_children[1]
+        if ast.literal_eval(content_bytes[rhs.start_byte:rhs.end_byte].decode('utf-8')) != expected:
+            return None
+    except Exception:
+        # 任何无法识别的情形都交给 LLM 处理
+        return None
+    return (content_bytes[:rhs.start_byte] + repr(actual).encode('utf-8') + content_bytes[rhs.end_byte:]).decode('utf-8')
+
+def _try_local_fixes(failures: List[dict], file_content: str) -> str:
+    """
+    依次对同一文件中的所有失败尝试本地修复，全部成功时返回一个统一差异格式的补丁，否则返回空字符串。
+    本地修复只替换同一行内的字面量，不会改变行号，因此可以在同一份内容上连续应用。
+    """
+    fixed_content = file_content
+    for failure in failures:
+        fixed_content = _apply_local_fix(failure, fixed_content)
+        if fixed_content is None:
+            return ""
+    filepath = failures[0]['filepath']
+    diff_lines = difflib.unified_diff(
+        file_content.splitlines(keepends=True), fixed_content.splitlines(keepends=True),
+        fromfile=f"a/{filepath}", tofile=f"b/{filepath}"
+    )
+    # 文件末尾没有换行符时，需要补上 `patch` 能识别的标记
+    return "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in diff_lines)
+
+
+_FIX_PATCH_SYSTEM_PROMPT = """
 您是一位专家级的软件调试工程师。您的任务是根据提供的 pytest 错误信息和完整的源文件内容，生成一个统一差异格式（unified diff）的补丁来修复这个错误。
 
 **规则:**
@@ -551,6 +1254,36 @@ async def _generate_fix_patch(
 ```
 """
 
+async def _request_fix_patch(user_prompt: str, client: OpenAIChatCompletionClient) -> str:
+    """向 LLM 发送修复请求并返回补丁内容，失败时返回空字符串。"""
+    try:
+        response = await client.create(
+            messages=[
+                SystemMessage(content=_FIX_PATCH_SYSTEM_PROMPT),
+                UserMessage(content=user_prompt),
+            ]
+        )
+        patch_content = response.content
+        if not isinstance(patch_content, str):
+            patch_content = str(patch_content)
+
+        logger.info(f"成功生成修复补丁:\n{patch_content}")
+        return patch_content
+    except Exception as e:
+        logger.error(f"生成补丁时发生错误: {e}")
+        return ""
+
+
+async def _generate_fix_patch(
+    failure_details: dict,
+    file_content: str,
+    client: OpenAIChatCompletionClient
+) -> str:
+    """
+    使用 LLM 生成一个用于修复代码的补丁。
+    """
+    logger.info("开始生成修复补丁...")
+
     user_prompt = f"""
 请为以下错误生成一个修复补丁：
 
@@ -572,23 +1305,45 @@ async def _generate_fix_patch(
 请严格按照规则，只输出可以直接应用的 `diff` 格式补丁。
 """
 
-    try:
-        from autogen_core.models import SystemMessage, UserMessage
-        response = await client.create(
-            messages=[
-                SystemMessage(content=system_prompt),
-                UserMessage(content=user_prompt),
-            ]
-        )
-        patch_content = response.content
-        if not isinstance(patch_content, str):
-            patch_content = str(patch_content)
+    return await _request_fix_patch(user_prompt, client)
 
-        logger.info(f"成功生成修复补丁:\n{patch_content}")
-        return patch_content
-    except Exception as e:
-        logger.error(f"生成补丁时发生错误: {e}")
-        return ""
+
+async def _generate_multi_fix_patch(
+    failures: List[dict],
+    file_content: str,
+    client: OpenAIChatCompletionClient
+) -> str:
+    """
+    使用 LLM 为同一文件中的多个失败生成一个包含多个 hunk 的补丁，一次性修复所有失败。
+    """
+    logger.info(f"开始为 {len(failures)} 个失败生成合并的修复补丁...")
+    filepath = failures[0]['filepath']
+
+    failure_sections = "\n\n".join(
+        f"""### 失败 {i}: {failure['test_name']}
+**错误类型:** {failure['error_type']}
+**错误信息:** {failure['error_message']}
+**行号:** {failure['line_number']}
+
+```
+{failure['full_traceback']}
+```"""
+        for i, failure in enumerate(failures, 1)
+    )
+
+    user_prompt = f"""
+以下 {len(failures)} 个失败都位于同一个文件 `{filepath}` 中，请生成**一个**补丁同时修复它们（每处修改对应一个 hunk）：
+
+{failure_sections}
+
+**完整的源文件内容 (`{filepath}`):**
+```
+{file_content}
+```
+
+请严格按照规则，只输出可以直接应用的 `diff` 格式补丁。
+"""
+    return await _request_fix_patch(user_prompt, client)
 
 
 async def run_tests_and_debug(
@@ -603,9 +1358,9 @@ async def run_tests_and_debug(
     1. 运行指定的 `test_command` (例如, `python3 -m pytest`, `npm test`)。
     2. 如果测试通过，则报告成功。
     3. 如果测试失败，它将启动一个循环（最多 `max_retries` 次）：
-       a. 解析 pytest 的错误日志以找出失败的文件和错误。
-       b. 读取相关的代码。
-       c. 使用 LLM 生成一个修复补丁。
+       a. 从 pytest 的 JUnit XML 报告（或错误日志）中找出失败的文件和错误，并按文件分组。
+       b. 读取失败最多的文件的代码。
+       c. 使用 LLM 为该文件中的所有失败生成一个修复补丁。
        d. 应用补丁。
        e. 重新运行测试。
     4. 返回最终的测试结果或调试过程的总结。
@@ -615,7 +1370,7 @@ async def run_tests_and_debug(
     for attempt in range(max_retries + 1):
         logger.info(f"第 {attempt + 1}/{max_retries + 1} 次尝试使用命令 '{test_command}' 运行测试...")
 
-        test_result = run_in_bash_session(test_command)
+        test_result, failures = _run_and_parse_streaming(test_command)
 
         if " passed" in test_result and "failed" not in test_result and "error" not in test_result:
             success_message = f"所有测试在第 {attempt + 1} 次尝试中成功通过。\n\n{test_result}"
@@ -627,8 +1382,7 @@ async def run_tests_and_debug(
             logger.error(failure_message)
             return failure_message
 
-        # 解析错误
-        failures = _parse_pytest_output(test_result)
+        # 失败信息已在测试运行时被增量解析
         if not failures:
             logger.warning("测试失败，但无法解析出具体的错误信息。将返回原始测试输出。")
             return f"测试失败，且无法解析错误。\n\n{test_result}"
@@ -636,43 +1390,57 @@ async def run_tests_and_debug(
         logger.info(f"成功解析出 {len(failures)} 个测试失败:")
 
         # --- 代码定位与上下文收集 ---
-        # 目前，我们只关注第一个失败来进行修复
-        first_failure = failures[0]
-        logger.info(f"正在为第一个失败的测试 '{first_failure['test_name']}' 收集上下文...")
+        # 按文件对失败进行分组，优先修复失败最多的文件，让一次补丁和一次测试运行覆盖尽可能多的失败
+        failures_by_file = defaultdict(list)
+        for failure in failures:
+            failures_by_file[failure['filepath']].append(failure)
+        target_filepath = max(failures_by_file, key=lambda fp: len(failures_by_file[fp]))
+        target_failures = failures_by_file[target_filepath]
+        logger.info(f"正在为文件 '{target_filepath}' 中的 {len(target_failures)} 个失败收集上下文...")
 
         try:
-            # 使用内部函数 _get_safe_path 和 read_text 来读取文件
-            file_path = _get_safe_path(first_failure['filepath'])
+            # 使用内部函数 _get_safe_path 和 read_text 来读取文件，每个文件只读取一次
+            file_path = _get_safe_path(target_filepath)
             original_content = file_path.read_text(encoding='utf-8')
-            logger.info(f"已成功读取文件 '{first_failure['filepath']}' 的内容。")
-
-            # --- LLM 生成修复 ---
-            patch_content = await _generate_fix_patch(
-                failure_details=first_failure,
-                file_content=original_content,
-                client=client
-            )
+            logger.info(f"已成功读取文件 '{target_filepath}' 的内容。")
+
+            # --- 生成修复: 优先尝试本地规则，无法处理时再交给 LLM ---
+            patch_content = _try_local_fixes(target_failures, original_content)
+            if patch_content:
+                logger.info(f"已在本地构造修复补丁，跳过 LLM 调用:\n{patch_content}")
+            elif len(target_failures) == 1:
+                patch_content = await _generate_fix_patch(
+                    failure_details=target_failures[0],
+                    file_content=original_content,
+                    client=client
+                )
+            else:
+                patch_content = await _generate_multi_fix_patch(
+                    failures=target_failures,
+                    file_content=original_content,
+                    client=client
+                )
 
             if not patch_content:
                 logger.error("LLM 未能生成修复补丁。终止调试循环。")
                 return f"测试失败，且LLM未能生成修复方案。\n\n{test_result}"
 
             # --- 应用补丁 ---
-            logger.info(f"正在向 {first_failure['filepath']} 应用修复补丁...")
-            apply_result = apply_patch(first_failure['filepath'], patch_content)
+            logger.info(f"正在向 {target_filepath} 应用修复补丁...")
+            apply_result = apply_patch(target_filepath, patch_content)
 
             if "应用补丁失败" in apply_result:
                 logger.error(f"应用补丁失败: {apply_result}。正在恢复文件...")
                 # 在应用补丁失败时，恢复文件以避免代码库处于损坏状态
-                overwrite_file_with_block(first_failure['filepath'], original_content)
-                logger.info(f"文件 '{first_failure['filepath']}' 已恢复到补丁应用前的状态。")
+                overwrite_file_with_block(target_filepath, original_content)
+                logger.info(f"文件 '{target_filepath}' 已恢复到补丁应用前的状态。")
                 return f"测试失败，且生成的补丁无法被应用。\n\n{apply_result}"
 
             logger.info("补丁已成功应用。进入下一轮测试验证...")
 
         except Exception as e:
             logger.error(f"为失败的测试收集上下文时发生错误: {e}")
-            return f"测试失败，并且在读取文件 {first_failure['filepath']} 时出错。"
+            return f"测试失败，并且在读取文件 {target_filepath} 时出错。"
 
     return "调试循环因未知原因完成。"
 run_tests_and_debug.is_dangerous = True
@@ -0,0 +1,95 @@
+import os
+import uuid
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# 测试会在工作区中创建 Python 源文件并通过子进程运行它们（bash 会话、pytest、CodeExecutorAgent），
+# 关闭字节码写入可避免在工作区中产生 __pycache__ 目录。子进程会继承该环境变量。
+os.environ.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+
+# minijules.indexing 在导入时就会实例化 ChromaDBVectorMemory，因此在收集任何测试模块之前，
+# 在模拟该重量级依赖的情况下统一导入一次 minijules 的各个模块。之后测试文件中的导入
+# 直接命中 sys.modules，无需再各自包裹 patch。
+with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
+    import minijules.indexing
+    import minijules.tools
+    import minijules.app
+
+@pytest.fixture(scope="session", autouse=True)
+def _warm_tree_sitter_languages():
+    """每个测试进程只加载一次各语言的 tree-sitter 语法，后续测试直接复用缓存。"""
+    for lang_config in minijules.tools._language_config().values():
+        minijules.tools._get_language(lang_config["language"])
+
+@pytest.fixture
+def patched_app_deps(mocker):
+    """模拟构造和运行 JulesApp 时用到的 agent 创建与工作区索引，供需要 App 实例的测试共用。"""
+    mocker.patch('minijules.app.create_core_agent')
+    mocker.patch('minijules.indexing.index_workspace', autospec=True)
+
+@pytest.fixture
+def record_calls(monkeypatch):
+    """
+    返回一个轻量的调用记录器：`record_calls(module, name)` 用包装函数替换模块中的函数，
+    原函数照常执行，每次调用的 (args, kwargs) 依次追加到返回的列表中。
+    """
+    def _record(module, name):
+        calls = []
+        original = getattr(module, name)
+
+        def wrapper(*args, **kwargs):
+            calls.append((args, kwargs))
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(module, name, wrapper)
+        return calls
+    return _record
+
+# New function added by MiniJules
+@pytest.fixture
+def assert_all_in():
+    """
+    返回一个断言函数：`assert_all_in(haystack, needles)` 断言所有子串都出现在 haystack 中，
+    失败时一次性列出全部缺失的子串。
+    """
+    def _assert_all_in(haystack, needles):
+        missing = [needle for needle in needles if needle not in haystack]
+        assert not missing, f"缺少以下内容: {missing}"
+    return _assert_all_in
+
+@pytest.fixture
+def mock_llm_client():
+    """提供一个接口与 OpenAIChatCompletionClient 一致的模拟客户端，`create` 为异步方法。"""
+    client = MagicMock()
+    client.create = AsyncMock()
+    return client
+
+# 各测试构造 JulesApp 时共用的 LLM 配置，只读，无需每个测试重新构建
+MOCK_CONFIG_LIST = [{'model': 'mock', 'api_key': 'mock'}]
+
+@pytest.fixture(scope="session")
+def mock_config_list():
+    """提供共享的模拟 LLM 配置列表。"""
+    return MOCK_CONFIG_LIST
+
+@pytest.fixture(scope="session")
+def workspace_root(tmp_path_factory):
+    """
+    整个测试会话共享的工作区根目录，由 pytest 负责清理。
+    根目录下只写一次空的 pytest 配置，各测试工作区中运行的 pytest 都会以它为准。
+    """
+    root = tmp_path_factory.mktemp("jules_ws")
+    (root / "pytest.ini").write_text("[pytest]\n")
+    return root
+
+@pytest.fixture
+def jules_workspace(workspace_root, monkeypatch):
+    """
+    为每个测试在会话根目录下创建一个独立的工作区子目录，
+    并让 tools 与 indexing 模块都指向它。所有需要工作区的测试共用这一个夹具。
+    """
+    workspace_path = workspace_root / uuid.uuid4().hex
+    workspace_path.mkdir()
+    monkeypatch.setattr(minijules.tools, 'WORKSPACE_DIR', workspace_path)
+    monkeypatch.setattr(minijules.indexing, 'WORKSPACE_DIR', workspace_path)
+    return workspace_path
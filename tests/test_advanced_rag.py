@@ -1,13 +1,9 @@
 import asyncio
-import pytest
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import AsyncMock
 
-# 这段 with patch 是必需的，因为 app 模块在顶层导入了这些
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
-    from minijules.app import JulesApp
+from minijules.app import JulesApp
 
-@pytest.mark.asyncio
-async def test_run_method_orchestrates_advanced_rag_flow(mocker):
+async def test_run_method_orchestrates_advanced_rag_flow(mocker, patched_app_deps, mock_config_list, jules_workspace):
     """
     集成测试: 验证 JulesApp.run 方法是否能正确地编排高级RAG流程。
 
@@ -26,17 +22,14 @@ async def test_run_method_orchestrates_advanced_rag_flow(mocker):
         return_value=mock_enhanced_context
     )
 
-    # 模拟其他在 run 方法中被调用的函数
-    mocker.patch('minijules.app.indexing.index_workspace', new_callable=AsyncMock)
+    # 模拟其他在 run 方法中被调用的函数（agent 创建和工作区索引由 patched_app_deps 模拟，
+    # 工作区 Git 初始化发生在 jules_workspace 提供的临时目录中，不会写入包目录）
     mock_group_chat_run = mocker.patch('autogen_agentchat.teams.RoundRobinGroupChat.run', new_callable=AsyncMock)
 
-    # 模拟 agent 的创建以避免初始化错误
-    mocker.patch('minijules.app.create_core_agent', return_value=MagicMock())
-
     # 2. --- 执行 ---
     # 初始化并运行 App
     # 使用一个最小化的配置，因为所有依赖都已被模拟
-    app = JulesApp(task_string=original_task, config_list=[{'model': 'mock', 'api_key': 'mock'}])
+    app = JulesApp(task_string=original_task, config_list=mock_config_list)
     await app.run()
 
     # 3. --- 验证 ---
@@ -1,13 +1,7 @@
-import pytest
-from unittest.mock import MagicMock, AsyncMock, patch
+import minijules.tools as tools
+from minijules.app import JulesApp
 
-# 模拟ChromaDB以隔离测试
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
-    import minijules.tools as tools
-    from minijules.app import JulesApp
-
-@pytest.mark.asyncio
-async def test_run_tests_and_debug_app_tool(mocker):
+async def test_run_tests_and_debug_app_tool(mocker, patched_app_deps, mock_config_list):
     """
     测试 tools.run_tests_and_debug_app 工具是否能正确地:
     1. 调用语言检测。
@@ -18,8 +12,6 @@ async def test_run_tests_and_debug_app_tool(mocker):
     mock_language = "python"
     mock_final_result = "All tests passed!"
 
-    # 模拟 app 依赖
-    mocker.patch('minijules.app.create_core_agent')
     # 现在模拟 tools 模块中的 OpenAIChatCompletionClient
     mocker.patch('minijules.tools.OpenAIChatCompletionClient')
 
@@ -27,13 +19,13 @@ async def test_run_tests_and_debug_app_tool(mocker):
     mock_detect_lang = mocker.patch('minijules.tools.detect_project_language', return_value=mock_language)
     mock_core_debugger = mocker.patch(
         'minijules.tools.run_tests_and_debug',
-        new_callable=AsyncMock,
+        autospec=True,
         return_value=mock_final_result
     )
 
     # 2. 执行
     # 创建 app 实例，因为被测工具需要它
-    app = JulesApp(task_string="test", config_list=[{'model': 'mock', 'api_key': 'mock'}])
+    app = JulesApp(task_string="test", config_list=mock_config_list)
     # 直接调用重构后的工具函数
     result = await tools.run_tests_and_debug_app(app)
 
@@ -1,36 +1,22 @@
+from pathlib import Path
 import pytest
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import MagicMock
 
-# 这段 with patch 是必需的，因为 tools 模块在顶层导入了这些
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
-    from minijules import tools
+from minijules import tools
 
-# --- 测试 _parse_pytest_output ---
-
-MOCK_PYTEST_FAILURE_OUTPUT = """
-============================= test session starts ==============================
-...
-____________________________ test_example_failure ____________________________
 
-self = <tests.test_example.TestExample object at 0x7f...>
+# --- 测试 _parse_pytest_output ---
 
-    def test_addition_fails(self):
->       assert 1 + 1 == 3
-E       assert (2 == 3)
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
 
-tests/test_example.py:10: AssertionError
-_________________ ERROR at setup of test_another_error _________________
+def _read_fixture(name: str) -> str:
+    """读取 tests/fixtures 下的测试日志。"""
+    return (FIXTURES_DIR / name).read_text(encoding="utf-8")
 
-    def setup_method(self, method):
->       raise ValueError("Setup failed")
-E       ValueError: Setup failed
+MOCK_PYTEST_FAILURE_OUTPUT = _read_fixture("pytest_failure.txt")
 
-tests/test_another.py:5: ValueError
-=========================== short test summary info ============================
-FAILED tests/test_example.py::TestExample::test_addition_fails - assert (2 == 3)
-ERROR tests/test_another.py::test_another_error
-========================= 1 failed, 1 error in 0.1s ==========================
-"""
+# 多个调试循环测试都使用同一段失败输出，只在模块加载时解析一次
+_PARSED_MOCK_FAILURES = tools._parse_pytest_output(MOCK_PYTEST_FAILURE_OUTPUT)
 
 def test_parse_pytest_output_extracts_failures_and_errors():
     """
@@ -58,10 +44,83 @@ def test_parse_pytest_output_extracts_failures_and_errors():
     assert failure_2['error_message'] == "Setup failed"
     assert "raise ValueError(\"Setup failed\")" in failure_2['full_traceback']
 
+MOCK_PYTEST_SHORT_TB_OUTPUT = _read_fixture("pytest_failure_short_tb.txt")
+
+def test_parse_pytest_output_handles_short_tracebacks():
+    """
+    验证 _parse_pytest_output 能解析 `--tb=short` 格式：定位到最后一帧，并从 E 行读取异常类型。
+    """
+    failures = tools._parse_pytest_output(MOCK_PYTEST_SHORT_TB_OUTPUT)
+
+    assert [(f['filepath'], f['line_number'], f['error_type'], f['error_message']) for f in failures] == [
+        ("tests/test_nested.py", 2, "KeyError", "'missing'"),
+        ("tests/test_calc.py", 3, "AssertionError", "assert 2 == 3"),
+    ]
+
+def test_run_and_parse_streaming_parses_failures_while_running(tmp_path, monkeypatch):
+    """
+    验证 _run_and_parse_streaming 能在命令运行时逐行解析失败信息，
+    并返回与 run_in_bash_session 格式一致的输出。
+    """
+    monkeypatch.setattr(tools, 'WORKSPACE_DIR', tmp_path)
+    (tmp_path / "pytest.log").write_text(MOCK_PYTEST_FAILURE_OUTPUT)
+
+    output, failures = tools._run_and_parse_streaming("cat pytest.log; exit 1")
+
+    assert output == tools.run_in_bash_session("cat pytest.log; exit 1")
+    assert failures == _PARSED_MOCK_FAILURES
+    assert len(failures) == 2
+
+
+@pytest.mark.integration
+def test_run_and_parse_streaming_reads_pytest_junit_report(tmp_path, monkeypatch, record_calls):
+    """
+    验证对 pytest 命令会从 JUnit XML 报告中提取失败信息，且报告文件在读取后被删除。
+    """
+    monkeypatch.setattr(tools, 'WORKSPACE_DIR', tmp_path)
+    (tmp_path / "test_calc.py").write_text("def test_add():\n    assert 1 + 1 == 3\n")
+    report_calls = record_calls(tools, '_parse_junit_report')
+
+    output, failures = tools._run_and_parse_streaming("python3 -m pytest -q -p no:cacheprovider")
+
+    assert "1 failed" in output
+    assert len(failures) == 1
+    assert failures[0]['test_name'] == "test_add"
+    assert failures[0]['filepath'] == "test_calc.py"
+    assert failures[0]['line_number'] == 2
+    assert failures[0]['error_type'] == "AssertionError"
+    assert len(report_calls) == 1
+    assert not report_calls[0][0][0].exists()
+    assert "generated xml file" not in output
+
+
+@pytest.mark.integration
+def test_run_and_parse_streaming_names_class_tests_and_collection_errors(tmp_path, monkeypatch):
+    """
+    验证从 JUnit 报告还原的用例名与 pytest 文本输出一致：类中的用例带有类名，收集错误标明出错的文件。
+    """
+    monkeypatch.setattr(tools, 'WORKSPACE_DIR', tmp_path)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_k.py").write_text("class TestK:\n    def test_m(self):\n        assert 1 == 2\n")
+
+    _, failures = tools._run_and_parse_streaming("python3 -m pytest -q -p no:cacheprovider")
+    assert [f['test_name'] for f in failures] == ["TestK.test_m"]
+
+    (tmp_path / "tests" / "test_b.py").write_text("import missing_module_for_minijules\n")
+    _, failures = tools._run_and_parse_streaming("python3 -m pytest -q -p no:cacheprovider")
+    assert [f['test_name'] for f in failures] == ["ERROR collecting tests/test_b.py"]
+
+
+def _streamed(*outputs):
+    """将原始测试输出包装成 _run_and_parse_streaming 返回值的迭代器，可直接用作 side_effect。"""
+    return iter(tuple(
+        (output, _PARSED_MOCK_FAILURES if output == MOCK_PYTEST_FAILURE_OUTPUT else tools._parse_pytest_output(output))
+        for output in outputs
+    ))
+
 # --- 接下来将是 run_tests_and_debug 的测试用例 ---
 
-@pytest.mark.asyncio
-async def test_run_tests_and_debug_succeeds_on_first_try(mocker):
+async def test_run_tests_and_debug_succeeds_on_first_try(mocker, assert_all_in):
     """
     验证当测试首次运行时就通过时，工具是否能正确报告成功并返回结果。
     """
@@ -69,20 +128,18 @@ async def test_run_tests_and_debug_succeeds_on_first_try(mocker):
     mock_test_command = "pytest"
     mock_success_output = "======================== 10 passed in 1.0s ========================"
 
-    # 模拟 run_in_bash_session 的返回值
-    mock_run_bash = mocker.patch('minijules.tools.run_in_bash_session', return_value=mock_success_output)
+    # 模拟 _run_and_parse_streaming 的返回值
+    mock_run_bash = mocker.patch('minijules.tools._run_and_parse_streaming', return_value=(mock_success_output, []))
 
     # 2. 执行
     result = await tools.run_tests_and_debug(test_command=mock_test_command, client=MagicMock())
 
     # 3. 验证
     mock_run_bash.assert_called_once_with(mock_test_command)
-    assert "所有测试在第 1 次尝试中成功通过" in result
-    assert mock_success_output in result
+    assert_all_in(result, ["所有测试在第 1 次尝试中成功通过", mock_success_output])
 
 
-@pytest.mark.asyncio
-async def test_run_tests_and_debug_succeeds_after_one_fix(mocker):
+async def test_run_tests_and_debug_succeeds_after_one_fix(mocker, assert_all_in):
     """
     验证工具在测试首次失败后，能否成功地完成一轮“解析-生成-应用-验证”循环。
     """
@@ -93,18 +150,17 @@ async def test_run_tests_and_debug_succeeds_after_one_fix(mocker):
     mock_file_content = "def test_addition_fails(self):\n    assert 1 + 1 == 3"
     mock_patch_content = "--- a/tests/test_example.py\n+++ b/tests/test_example.py\n@@ -1,2 +1,2 @@\n-    assert 1 + 1 == 3\n+    assert 1 + 1 == 2"
 
-    # 模拟 run_in_bash_session 在第一次调用时失败，第二次成功
-    mock_run_bash = mocker.patch('minijules.tools.run_in_bash_session', side_effect=[
+    # 模拟 _run_and_parse_streaming 在第一次调用时失败，第二次成功
+    mock_run_bash = mocker.patch('minijules.tools._run_and_parse_streaming', side_effect=_streamed(
         mock_failure_output,
         mock_success_output
-    ])
+    ))
 
     # 模拟文件读取
-    mocker.patch('minijules.tools._get_safe_path', return_value=MagicMock())
-    mocker.patch('pathlib.Path.read_text', return_value=mock_file_content)
+    mocker.patch('minijules.tools._get_safe_path', return_value=MagicMock(**{'read_text.return_value': mock_file_content}))
 
     # 模拟补丁生成和应用
-    mock_generate_patch = mocker.patch('minijules.tools._generate_fix_patch', new_callable=AsyncMock, return_value=mock_patch_content)
+    mock_generate_patch = mocker.patch('minijules.tools._generate_fix_patch', autospec=True, return_value=mock_patch_content)
     mock_apply_patch = mocker.patch('minijules.tools.apply_patch', return_value="补丁已成功应用")
 
     # 2. 执行
@@ -114,12 +170,10 @@ async def test_run_tests_and_debug_succeeds_after_one_fix(mocker):
     assert mock_run_bash.call_count == 2
     mock_generate_patch.assert_called_once()
     mock_apply_patch.assert_called_once_with("tests/test_example.py", mock_patch_content)
-    assert "所有测试在第 2 次尝试中成功通过" in result
-    assert mock_success_output in result
+    assert_all_in(result, ["所有测试在第 2 次尝试中成功通过", mock_success_output])
 
 
-@pytest.mark.asyncio
-async def test_run_tests_and_debug_fails_after_max_retries(mocker):
+async def test_run_tests_and_debug_fails_after_max_retries(mocker, assert_all_in):
     """
     验证当测试在所有重试后仍然失败时，工具是否会正确地放弃并报告最终的失败结果。
     """
@@ -127,13 +181,12 @@ async def test_run_tests_and_debug_fails_after_max_retries(mocker):
     max_retries = 2
     mock_test_command = "pytest"
 
-    # 模拟 run_in_bash_session 总是返回失败
-    mock_run_bash = mocker.patch('minijules.tools.run_in_bash_session', return_value=MOCK_PYTEST_FAILURE_OUTPUT)
+    # 模拟 _run_and_parse_streaming 总是返回失败
+    mock_run_bash = mocker.patch('minijules.tools._run_and_parse_streaming', return_value=next(_streamed(MOCK_PYTEST_FAILURE_OUTPUT)))
 
     # 模拟文件读取和补丁生成/应用
-    mocker.patch('minijules.tools._get_safe_path')
-    mocker.patch('pathlib.Path.read_text', return_value="file content")
-    mocker.patch('minijules.tools._generate_fix_patch', new_callable=AsyncMock, return_value="mock patch")
+    mocker.patch('minijules.tools._get_safe_path', return_value=MagicMock(**{'read_text.return_value': "file content"}))
+    mocker.patch('minijules.tools._generate_fix_patch', autospec=True, return_value="mock patch")
     mocker.patch('minijules.tools.apply_patch', return_value="补丁已成功应用")
 
     # 2. 执行
@@ -146,12 +199,10 @@ async def test_run_tests_and_debug_fails_after_max_retries(mocker):
     # 3. 验证
     # 总共运行次数 = 初始尝试 + max_retries
     assert mock_run_bash.call_count == max_retries + 1
-    assert f"在达到 {max_retries + 1} 次尝试后，测试仍然失败" in result
-    assert MOCK_PYTEST_FAILURE_OUTPUT in result
+    assert_all_in(result, [f"在达到 {max_retries + 1} 次尝试后，测试仍然失败", MOCK_PYTEST_FAILURE_OUTPUT])
 
 
-@pytest.mark.asyncio
-async def test_run_tests_and_debug_handles_patch_application_failure(mocker):
+async def test_run_tests_and_debug_handles_patch_application_failure(mocker, assert_all_in):
     """
     验证当生成的补丁无法被应用时，工具是否能正确报告失败并执行回滚。
     """
@@ -160,13 +211,11 @@ async def test_run_tests_and_debug_handles_patch_application_failure(mocker):
     mock_failure_output = MOCK_PYTEST_FAILURE_OUTPUT
     mock_file_content = "original content"
 
-    mocker.patch('minijules.tools.run_in_bash_session', return_value=mock_failure_output)
+    mocker.patch('minijules.tools._run_and_parse_streaming', return_value=next(_streamed(mock_failure_output)))
     # 正确地模拟文件读取
-    mock_path = MagicMock()
-    mock_path.read_text.return_value = mock_file_content
-    mocker.patch('minijules.tools._get_safe_path', return_value=mock_path)
+    mocker.patch('minijules.tools._get_safe_path', return_value=MagicMock(**{'read_text.return_value': mock_file_content}))
 
-    mocker.patch('minijules.tools._generate_fix_patch', new_callable=AsyncMock, return_value="bad patch")
+    mocker.patch('minijules.tools._generate_fix_patch', autospec=True, return_value="bad patch")
 
     # 模拟补丁应用失败
     mock_apply_patch_failure_msg = "应用补丁失败: Hunk #1 FAILED at 1."
@@ -180,8 +229,82 @@ async def test_run_tests_and_debug_handles_patch_application_failure(mocker):
 
     # 3. 验证
     mock_apply_patch.assert_called_once()
-    assert "生成的补丁无法被应用" in result
-    assert mock_apply_patch_failure_msg in result
+    assert_all_in(result, ["生成的补丁无法被应用", mock_apply_patch_failure_msg])
 
     # 验证文件恢复逻辑是否被调用
-    mock_overwrite_file.assert_called_once_with("tests/test_example.py", mock_file_content)
\ No newline at end of file
+    mock_overwrite_file.assert_called_once_with("tests/test_example.py", mock_file_content)
+
+def test_try_local_fixes_rewrites_literal_assertion(tmp_path, monkeypatch):
+    """
+    验证 _try_local_fixes 能否为 `assert X == Y` 类型的失败在本地构造出可应用的补丁，
+    并在无法识别的情形下返回空字符串以回退到 LLM。
+    """
+    file_content = "def test_addition():\n    assert 1 + 1 == 3"
+    failure = {
+        "test_name": "test_addition",
+        "filepath": "test_math.py",
+        "line_number": 2,
+        "error_type": "AssertionError",
+        "error_message": "assert (2 == 3)",
+        "full_traceback": "",
+    }
+
+    patch_content = tools._try_local_fixes([failure], file_content)
+
+    assert "-    assert 1 + 1 == 3" in patch_content
+    assert "+    assert 1 + 1 == 2" in patch_content
+
+    monkeypatch.setattr(tools, 'WORKSPACE_DIR', tmp_path)
+    (tmp_path / "test_math.py").write_text(file_content)
+    assert "成功" in tools.apply_patch("test_math.py", patch_content)
+    assert (tmp_path / "test_math.py").read_text() == "def test_addition():\n    assert 1 + 1 == 2"
+
+    # 报告的期望值与源码中的字面量不一致时，不做本地修复
+    assert tools._try_local_fixes([{**failure, "error_message": "assert (2 == 4)"}], file_content) == ""
+
+
+async def test_run_tests_and_debug_batches_failures_in_same_file(mocker):
+    """
+    验证当多个失败位于同一文件时，工具只读取该文件一次，并请求一个合并的多 hunk 补丁。
+    """
+    # 1. 准备: 两个失败都位于 tests/test_example.py，且无法在本地修复
+    second_block = MOCK_PYTEST_FAILURE_OUTPUT.replace("test_another.py:5", "test_example.py:20")
+    mock_success_output = "======================== 10 passed in 1.0s ========================"
+    mocker.patch('minijules.tools._run_and_parse_streaming', side_effect=_streamed(second_block, mock_success_output))
+
+    mock_path = MagicMock(**{'read_text.return_value': "file content"})
+    mock_get_safe_path = mocker.patch('minijules.tools._get_safe_path', return_value=mock_path)
+    mock_single = mocker.patch('minijules.tools._generate_fix_patch', autospec=True)
+    mock_multi = mocker.patch('minijules.tools._generate_multi_fix_patch', autospec=True, return_value="multi patch")
+    mock_apply_patch = mocker.patch('minijules.tools.apply_patch', return_value="补丁已成功应用")
+
+    # 2. 执行
+    result = await tools.run_tests_and_debug(test_command="pytest", client=MagicMock())
+
+    # 3. 验证
+    mock_get_safe_path.assert_called_once_with("tests/test_example.py")
+    mock_path.read_text.assert_called_once_with(encoding='utf-8')
+    mock_single.assert_not_called()
+    mock_multi.assert_called_once()
+    assert len(mock_multi.call_args.kwargs['failures']) == 2
+    mock_apply_patch.assert_called_once_with("tests/test_example.py", "multi patch")
+    assert "所有测试在第 2 次尝试中成功通过" in result
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("source", [
+    'def make():\n    return "a" * 300\n\ndef test_value():\n    assert make() == "short"\n',
+    'def test_value():\n    assert list(range(100)) == [1, 2]\n',
+], ids=["truncated-string", "truncated-list"])
+def test_try_local_fixes_skips_values_truncated_by_pytest(source, tmp_path, monkeypatch):
+    """
+    验证 pytest 截断了实际值（以 `...` 省略）时不做本地修复，而是回退到 LLM，
+    避免把截断后的内容或 Ellipsis 写回源码。
+    """
+    monkeypatch.setattr(tools, 'WORKSPACE_DIR', tmp_path)
+    (tmp_path / "test_trunc.py").write_text(source)
+
+    _, failures = tools._run_and_parse_streaming("python3 -m pytest -q -p no:cacheprovider")
+
+    assert len(failures) == 1
+    assert tools._try_local_fixes(failures, source) == ""
@@ -1,31 +1,7 @@
-import sys
-from unittest.mock import MagicMock, patch
-import pytest
-from pathlib import Path
-import shutil
-
-# 使用 patch 来精确模拟重量级依赖，避免在导入时就实例化
-# 这解决了 'chromadb is not a package' 的问题
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
-    from minijules import indexing
-
-# --- 测试设置 ---
-TEST_WORKSPACE_NAME = "temp_indexing_test_workspace"
-TEST_WORKSPACE_DIR = Path(__file__).parent.resolve() / TEST_WORKSPACE_NAME
-
-@pytest.fixture(scope="function", autouse=True)
-def setup_and_teardown_test_workspace(monkeypatch):
-    """为每个测试创建一个干净、隔离的工作区。"""
-    if TEST_WORKSPACE_DIR.exists():
-        shutil.rmtree(TEST_WORKSPACE_DIR)
-    TEST_WORKSPACE_DIR.mkdir()
-    monkeypatch.setattr(indexing, 'WORKSPACE_DIR', TEST_WORKSPACE_DIR)
-    yield
-    if TEST_WORKSPACE_DIR.exists():
-        shutil.rmtree(TEST_WORKSPACE_DIR)
+from minijules import indexing
 
 # --- 测试用例 ---
-def test_docstring_and_comment_extraction():
+def test_docstring_and_comment_extraction(jules_workspace):
     """
     测试 extract_chunks 函数是否能:
     1. 优先提取 Python 的 docstring。
@@ -50,7 +26,7 @@ def say_hello(name):
 def function_without_comment():
     pass
 """
-    test_file_path = TEST_WORKSPACE_DIR / "test_math.py"
+    test_file_path = jules_workspace / "test_math.py"
     test_file_path.write_text(test_file_content, encoding="utf-8")
 
     # 2. 执行块提取
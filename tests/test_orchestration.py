@@ -1,30 +1,26 @@
 import pytest
 import asyncio
-from unittest.mock import MagicMock, AsyncMock, patch
+from types import SimpleNamespace as NS
+from unittest.mock import MagicMock
 
-# --- 模拟重量级依赖 ---
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory'):
-    from minijules.app import JulesApp
-    from minijules import tools
+from minijules.app import JulesApp
+from minijules import tools
 
-@pytest.mark.asyncio
-async def test_app_initializes_and_patches_correctly(mocker):
+
+async def test_app_initializes_and_patches_correctly(mocker, mock_llm_client, mock_config_list):
     """
     一个非常简单的“健全性”测试，验证 App 能否在所有 patch 都生效的情况下成功初始化。
     """
-    mocker.patch('argparse.ArgumentParser.parse_args', return_value=MagicMock(task="test", max_steps=1))
-    mocker.patch('minijules.agents.OpenAIChatCompletionClient')
-    mocker.patch('minijules.indexing.index_workspace', new_callable=AsyncMock)
-    mocker.patch('minijules.indexing.code_rag_memory', MagicMock())
-    mocker.patch('minijules.indexing.task_history_memory', MagicMock())
+    mocker.patch('minijules.agents.OpenAIChatCompletionClient', return_value=mock_llm_client)
+    mocker.patch('minijules.indexing.index_workspace', autospec=True)
+    mocker.patch.multiple('minijules.indexing', code_rag_memory=MagicMock(), task_history_memory=MagicMock())
 
     try:
-        JulesApp(task_string="test", config_list=[{'model': 'mock'}], max_steps=1)
+        JulesApp(task_string="test", config_list=mock_config_list, max_steps=1)
     except Exception as e:
         pytest.fail(f"JulesApp 初始化失败，即使所有依赖都被模拟了: {e}")
 
-@pytest.mark.asyncio
-async def test_request_code_review_tool(mocker):
+async def test_request_code_review_tool(mocker, mock_llm_client, patched_app_deps, mock_config_list, assert_all_in):
     """
     测试 tools.request_code_review 工具是否能正确构建提示并调用LLM。
     """
@@ -35,32 +31,25 @@ async def test_request_code_review_tool(mocker):
 
     # 2. 模拟外部依赖
     mocker.patch('minijules.tools.git_diff', return_value=mock_diff)
-    # 模拟 agent 创建，避免在 App 初始化时因 mock model name 出错
-    mocker.patch('minijules.app.create_core_agent')
 
     # 模拟在 tools.py 中创建的 client
-    mock_llm_response = MagicMock()
-    mock_llm_response.content = mock_review_response
-    mock_reviewer_client = MagicMock()
-    mock_reviewer_client.create = AsyncMock(return_value=mock_llm_response)
-    mocker.patch('minijules.tools.OpenAIChatCompletionClient', return_value=mock_reviewer_client)
+    mock_llm_client.create.return_value = NS(content=mock_review_response)
+    mocker.patch('minijules.tools.OpenAIChatCompletionClient', return_value=mock_llm_client)
 
     # 3. 初始化App
-    app = JulesApp(task_string=test_task, config_list=[{'model': 'mock', 'api_key': 'mock_key'}])
+    app = JulesApp(task_string=test_task, config_list=mock_config_list)
 
     # 4. 调用被测试的工具 (重构后的版本)
     result = await tools.request_code_review(app)
 
     # 5. 验证
-    mock_reviewer_client.create.assert_called_once()
+    mock_llm_client.create.assert_called_once()
 
-    messages = mock_reviewer_client.create.call_args.kwargs['messages']
+    messages = mock_llm_client.create.call_args.kwargs['messages']
     system_message = messages[0].content
     user_prompt = messages[1].content
 
     assert "您是一位资深的软件架构师" in system_message
-    assert test_task in user_prompt
-    assert mock_diff in user_prompt
+    assert_all_in(user_prompt, [test_task, mock_diff])
 
-    assert mock_review_response in result
-    assert "代码评审结果" in result
\ No newline at end of file
+    assert_all_in(result, [mock_review_response, "代码评审结果"])
\ No newline at end of file
@@ -1,22 +1,23 @@
 import pytest
-from unittest.mock import MagicMock, patch
 
-# New function added by MiniJules
-# 模拟ChromaDB以隔离测试
-with patch('autogen_ext.memory.chromadb.ChromaDBVectorMemory', MagicMock()):
-    import minijules.tools as tools
-    from minijules.app import JulesApp
-    from minijules.types import TaskState
+import minijules.tools as tools
+from minijules.app import JulesApp
+from minijules.types import TaskState
+
+@pytest.fixture(scope="module")
+def shared_app(module_mocker, mock_config_list):
+    """整个模块共享一个模拟了核心依赖的 JulesApp 实例，只构建一次。"""
+    module_mocker.patch('minijules.app.create_core_agent')
+    module_mocker.patch('minijules.indexing.index_workspace', autospec=True)
+    return JulesApp(task_string="test task", config_list=mock_config_list)
 
 @pytest.fixture
-def app_instance(mocker):
-    """提供一个模拟了核心依赖的 JulesApp 实例。"""
-    mocker.patch('minijules.app.create_core_agent')
-    app = JulesApp(task_string="test task", config_list=[{'model': 'mock'}])
-    return app
+def app_instance(shared_app):
+    """提供共享的 JulesApp 实例，并在每个测试前重置其任务状态。"""
+    shared_app.state = TaskState(task_string="test task")
+    return shared_app
 
 # New function added by MiniJules
-@pytest.mark.asyncio
 async def test_set_plan_tool(app_instance):
     """测试 set_plan 工具是否能正确更新应用状态。"""
     # 1. 准备
@@ -33,7 +34,6 @@ async def test_set_plan_tool(app_instance):
     assert "1/2" in result
 
 # New function added by MiniJules
-@pytest.mark.asyncio
 async def test_record_user_approval_for_plan_tool(app_instance):
     """测试 record_user_approval_for_plan 工具。"""
     # 前置条件：必须先有一个计划
@@ -45,7 +45,6 @@ async def test_record_user_approval_for_plan_tool(app_instance):
     assert "计划已获批准" in result
 
 # New function added by MiniJules
-@pytest.mark.asyncio
 async def test_plan_step_complete_tool(app_instance):
     """测试 plan_step_complete 工具的逻辑。"""
     # 前置条件
@@ -66,7 +65,6 @@ async def test_plan_step_complete_tool(app_instance):
     assert "所有计划步骤均已完成" in result2
 
 # New function added by MiniJules
-@pytest.mark.asyncio
 async def test_plan_step_complete_requires_approval(app_instance):
     """测试 plan_step_complete 在计划未批准时是否会正确返回错误。"""
     app_instance.state.plan = "1. 某计划"
@@ -1,7 +1,5 @@
-import pytest
 import asyncio
-import shutil
-from pathlib import Path
+import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 
 # 导入真正的AutoGen组件
@@ -10,38 +8,22 @@ from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
 from autogen_agentchat.messages import TextMessage
 from autogen_core import CancellationToken
 
-# 导入我们需要模拟或配置的本地模块
-from minijules import tools
-
-# --- Pytest Fixtures ---
-@pytest.fixture
-def setup_test_workspace(monkeypatch):
-    """为每个测试创建一个干净、隔离的工作区。"""
-    workspace_path = Path('./final_test_workspace').resolve()
-    if workspace_path.exists():
-        shutil.rmtree(workspace_path)
-    workspace_path.mkdir()
-
-    # 将工具模块的工作目录指向我们的测试工作区
-    monkeypatch.setattr(tools, 'WORKSPACE_DIR', workspace_path)
-
-    # 创建一个空的pytest配置文件
-    (workspace_path / "pytest.ini").write_text("[pytest]\n")
-
-    yield workspace_path
-    shutil.rmtree(workspace_path)
+# 精简的 pytest 调用：不写缓存、不输出头部信息、遇到第一个失败即停止
+PYTEST_COMMAND = "python3 -m pytest -p no:cacheprovider --no-header -q -x"
 
 # --- 真正的集成测试 ---
 
-@pytest.mark.asyncio
-async def test_code_executor_agent_handles_tdd_flow(setup_test_workspace):
+@pytest.mark.integration
+async def test_code_executor_agent_handles_tdd_flow(jules_workspace, monkeypatch):
     """
     这个测试通过模拟一个 "代码生成Agent" 发送消息，来验证真实的 "CodeExecutorAgent"
     是否能正确地执行一个TDD流程。
     """
     # 1. 设置一个真实的 CodeExecutorAgent
     # 它将在我们隔离的工作区中执行代码
-    code_executor = LocalCommandLineCodeExecutor(work_dir=setup_test_workspace)
+    # 子进程中的 pytest 无需扫描并加载已安装的插件，以缩短每次启动的时间（字节码缓存已在 conftest 中统一关闭）
+    monkeypatch.setenv("PYTEST_DISABLE_PLUGIN_AUTOLOAD", "1")
+    code_executor = LocalCommandLineCodeExecutor(work_dir=jules_workspace, timeout=30)
     code_executor_agent = CodeExecutorAgent(
         name="TestCodeExecutor",
         code_executor=code_executor,
@@ -63,11 +45,11 @@ def test_add():
         source="MockCoreAgent"
     )
     # 将此消息写入一个文件中，以供CodeExecutorAgent执行
-    (setup_test_workspace / "test_calculator.py").write_text(fail_test_content)
+    (jules_workspace / "test_calculator.py").write_text(fail_test_content)
 
     # --- 第2步: 模拟CoreAgent请求运行测试 ---
     run_test_message = TextMessage(
-        content="现在我将运行测试，预期它会因为缺少 `calculator` 模块而失败。\n```sh\npython3 -m pytest\n```",
+        content=f"现在我将运行测试，预期它会因为缺少 `calculator` 模块而失败。\n```sh\n{PYTEST_COMMAND}\n```",
         source="MockCoreAgent"
     )
 
@@ -89,11 +71,11 @@ def add(a, b):
         source="MockCoreAgent"
     )
     # 将实现代码写入文件
-    (setup_test_workspace / "calculator.py").write_text(impl_code_content)
+    (jules_workspace / "calculator.py").write_text(impl_code_content)
 
     # --- 第4步: 模拟CoreAgent再次请求运行测试 ---
     run_test_again_message = TextMessage(
-        content="实现代码已编写完毕。现在我将再次运行测试，预期它会通过。\n```sh\npython3 -m pytest\n```",
+        content=f"实现代码已编写完毕。现在我将再次运行测试，预期它会通过。\n```sh\n{PYTEST_COMMAND}\n```",
         source="MockCoreAgent"
     )
 
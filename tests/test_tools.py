@@ -1,32 +1,29 @@
+import os
+import time
 import pytest
-from pathlib import Path
-import shutil
 
 # 导入被测试的模块
 from minijules import tools
 
+
 # --- 测试设置 ---
-TEST_WORKSPACE_NAME = "temp_tools_test_workspace"
-TEST_WORKSPACE_DIR = Path(__file__).parent.resolve() / TEST_WORKSPACE_NAME
-
-@pytest.fixture(scope="function", autouse=True)
-def setup_and_teardown_test_workspace(monkeypatch):
-    """为每个测试创建一个干净、隔离的工作区。"""
-    if TEST_WORKSPACE_DIR.exists():
-        shutil.rmtree(TEST_WORKSPACE_DIR)
-    TEST_WORKSPACE_DIR.mkdir()
-    monkeypatch.setattr(tools, 'WORKSPACE_DIR', TEST_WORKSPACE_DIR)
-    yield
-    if TEST_WORKSPACE_DIR.exists():
-        shutil.rmtree(TEST_WORKSPACE_DIR)
+# 每个测试都在 conftest 提供的独立工作区中运行
+pytestmark = pytest.mark.usefixtures("jules_workspace")
 
 # --- 工具测试 ---
 
-def test_apply_patch_success():
-    """测试 apply_patch 是否能成功应用一个有效的补丁。"""
-    filename = "patch_me.txt"
-    original_content = "line 1\nline 2\nline 3\n"
-    patch_content = (
+@pytest.fixture
+def make_file():
+    """返回一个在工作区中创建文件的工厂：`make_file(name, content)` 写入文件并返回文件名。"""
+    def _make(name, content):
+        create_result = tools.overwrite_file_with_block(name, content)
+        assert "成功" in create_result, f"测试设置失败: 无法创建文件: {create_result}"
+        return name
+    return _make
+
+def _line_two_patch(filename):
+    """把第二行 `line 2` 改为 `line two` 的统一差异格式补丁。"""
+    return (
         f"--- a/{filename}\n"
         f"+++ b/{filename}\n"
         "@@ -1,3 +1,3 @@\n"
@@ -35,40 +32,296 @@ def test_apply_patch_success():
         "+line two\n"
         " line 3\n"
     )
-    expected_content = "line 1\nline two\nline 3\n"
 
-    # 1. 创建初始文件
-    create_result = tools.overwrite_file_with_block(filename, original_content)
-    assert "成功" in create_result, f"测试设置失败: 无法创建文件: {create_result}"
+def test_apply_patch_success(make_file):
+    """测试 apply_patch 是否能成功应用一个有效的补丁。"""
+    filename = make_file("patch_me.txt", "line 1\nline 2\nline 3\n")
 
-    # 2. 应用补丁
-    patch_result = tools.apply_patch(filename, patch_content)
+    patch_result = tools.apply_patch(filename, _line_two_patch(filename))
     assert "成功" in patch_result, f"应用补丁失败: {patch_result}"
 
-    # 3. 验证内容
-    read_result = tools.read_file(filename)
-    assert read_result == expected_content
+    assert tools.read_file(filename) == "line 1\nline two\nline 3\n"
+
+def test_apply_patch_applies_offset_hunks_in_process(make_file, monkeypatch):
+    """测试上下文可逐字匹配的补丁（即使存在行偏移）直接在进程内应用，不启动 `patch` 子进程。"""
+    filename = make_file("patch_offset.txt", "header\nline 1\nline 2\nline 3\n")
+    monkeypatch.setattr(tools._bash_session, "run", lambda *args, **kwargs: pytest.fail("不应调用 patch 命令"))
 
-def test_apply_patch_failure():
+    patch_result = tools.apply_patch(filename, _line_two_patch(filename))
+    assert "成功" in patch_result, f"应用补丁失败: {patch_result}"
+    assert tools.read_file(filename) == "header\nline 1\nline two\nline 3\n"
+
+def test_apply_patch_anchors_hunks_with_uneven_context_like_patch(make_file, record_calls):
+    """
+    测试前导与尾随上下文行数不同的 hunk 按 `patch` 的规则锚定：
+    尾随上下文较少的只能应用在文件末尾，前导上下文较少的只能应用在文件开头，否则交给 `patch` 命令。
+    """
+    bash_calls = record_calls(tools._bash_session, "run")
+
+    # 末尾追加的补丁不会落在更早出现的相同上下文上
+    appended = make_file("append.txt", "a\nb\nx\ny\na\nb\n")
+    patch_result = tools.apply_patch(appended, "--- a/append.txt\n+++ b/append.txt\n@@ -1,2 +1,3 @@\n a\n b\n+c\n")
+    assert "成功" in patch_result, f"应用补丁失败: {patch_result}"
+    assert tools.read_file(appended) == "a\nb\nx\ny\na\nb\nc\n"
+    assert bash_calls == []
+
+    # 文件开头的 hunk 在内容发生偏移后不在进程内应用，由 `patch` 以模糊匹配处理
+    shifted = make_file("shifted.txt", "header\nline 1\nline 2\n")
+    patch_result = tools.apply_patch(shifted, "--- a/shifted.txt\n+++ b/shifted.txt\n@@ -1,2 +1,2 @@\n-line 1\n+line one\n line 2\n")
+    assert "成功" in patch_result, f"应用补丁失败: {patch_result}"
+    assert tools.read_file(shifted) == "header\nline one\nline 2\n"
+    assert len(bash_calls) == 1
+
+def test_apply_patch_failure(make_file):
     """测试 apply_patch 在补丁不匹配时是否会失败并返回错误信息。"""
-    filename = "patch_me_fail.txt"
-    original_content = "some completely different content\n"
-    patch_content = (
-        f"--- a/{filename}\n"
-        f"+++ b/{filename}\n"
-        "@@ -1,3 +1,3 @@\n"
-        " line 1\n"
-        "-line 2\n"
-        "+line two\n"
-        " line 3\n"
+    filename = make_file("patch_me_fail.txt", "some completely different content\n")
+
+    # 应用一个不匹配的补丁，验证它是否失败并返回了 stderr
+    patch_result = tools.apply_patch(filename, _line_two_patch(filename))
+    assert "失败" in patch_result
+    assert "STDERR" in patch_result or "hunk FAILED" in patch_result.lower()
+
+def test_run_in_bash_session_reuses_shell_and_resets_cwd(jules_workspace):
+    """测试常驻 bash 会话能否正确分离 stdout/stderr、返回码，并在每次调用前重置工作目录。"""
+    result = tools.run_in_bash_session("echo out; echo err >&2; cd /; exit 3")
+    assert "STDOUT:\nout\n" in result
+    assert "STDERR:\nerr\n" in result
+    assert "返回码: 3" in result
+
+    # `exit` 和 `cd` 只作用于该命令的子 shell，下一次调用仍在工作区中执行
+    result = tools.run_in_bash_session("pwd")
+    assert str(jules_workspace) in result
+    assert "返回码: 0" in result
+
+def test_run_in_bash_session_isolates_commands(jules_workspace, monkeypatch):
+    """测试常驻 bash 会话中的命令互不影响：后台输出、shell 选项不会串到下一条命令，且环境变量随 os.environ 更新。"""
+    tools.run_in_bash_session("(sleep 0.2; echo LATE) &")
+    time.sleep(0.5)
+    assert tools.run_in_bash_session("echo next") == "STDOUT:\nnext\n\n返回码: 0"
+
+    tools.run_in_bash_session("set -e")
+    tools.run_in_bash_session("false")
+    assert "STDOUT:\nalive\n" in tools.run_in_bash_session("echo alive")
+
+    monkeypatch.setenv("MINIJULES_TEST_VAR", "fresh")
+    assert "STDOUT:\n[fresh]\n" in tools.run_in_bash_session("echo [$MINIJULES_TEST_VAR]")
+    monkeypatch.delenv("MINIJULES_TEST_VAR")
+    assert "STDOUT:\n[]\n" in tools.run_in_bash_session("echo [$MINIJULES_TEST_VAR]")
+
+def test_list_project_structure_keeps_sorted_file_order(jules_workspace):
+    """测试 list_project_structure 是否按文件路径排序输出各文件的类和函数结构。"""
+    (jules_workspace / "pkg").mkdir()
+    (jules_workspace / "pkg" / "calc.py").write_text("class Calculator:\n    class Inner:\n        pass\n")
+    (jules_workspace / "app.js").write_text(
+        "class Greeter {\n  greet() { return 1; }\n}\nfunction hello() {}\nconst arrow = () => 1;\nconst notfn = 3;\n"
     )
+    (jules_workspace / "notes.txt").write_text("class Ignored:\n")
 
-    # 1. 创建初始文件
-    tools.overwrite_file_with_block(filename, original_content)
+    result = tools.list_project_structure()
 
-    # 2. 应用一个不匹配的补丁
-    patch_result = tools.apply_patch(filename, patch_content)
+    assert result.splitlines() == [
+        "Project Structure:",
+        "📁 app.js",
+        "  class Greeter",
+        "    def greet",
+        "  def hello",
+        "  def arrow",
+        "📁 pkg/calc.py",
+        "  class Calculator",
+        "    class Inner",
+    ]
 
-    # 3. 验证它是否失败并返回了 stderr
-    assert "失败" in patch_result
-    assert "STDERR" in patch_result or "hunk FAILED" in patch_result.lower()
\ No newline at end of file
+def test_list_project_structure_parses_large_files_via_mmap(monkeypatch, jules_workspace):
+    """测试超过阈值的大文件走 mmap 流式解析时，输出与普通读取一致。"""
+    (jules_workspace / "big.js").write_text("class Big {\n  run() {}\n}\n" * 2000)
+    expected = tools.list_project_structure()
+
+    monkeypatch.setattr(tools, 'MMAP_PARSE_THRESHOLD', 1)
+    assert tools.list_project_structure() == expected
+    assert expected.count("    def run") == 2000
+
+def test_list_project_structure_skips_parsing_files_without_keywords(record_calls, jules_workspace):
+    """测试不含任何符号关键字的文件不会进入 tree-sitter 解析。"""
+    (jules_workspace / "settings.py").write_text("DEBUG = True\nNAME = 'app'\n")
+    (jules_workspace / "main.py").write_text("class Main:\n    pass\n")
+    get_ast_calls = record_calls(tools, '_get_ast')
+
+    structure = tools.list_project_structure()
+
+    assert "📁 settings.py" in structure
+    assert "class Main" in structure
+    assert [args[0].name for args, _ in get_ast_calls] == ["main.py"]
+
+def test_list_project_structure_keeps_js_object_method_shorthand(jules_workspace):
+    """测试只含对象字面量方法简写的 JS 文件仍会被解析（JavaScript 不做关键字预筛）。"""
+    (jules_workspace / "calls.js").write_text("foo({ m() { return 1 } });\n")
+
+    assert "def m" in tools.list_project_structure()
+
+def test_project_scans_skip_ignored_directories(jules_workspace):
+    """测试项目扫描是否会跳过 node_modules、.git 等目录。"""
+    (jules_workspace / "node_modules" / "lib").mkdir(parents=True)
+    for i in range(3):
+        (jules_workspace / "node_modules" / "lib" / f"dep{i}.js").write_text("function dep() {}\n")
+    (jules_workspace / "main.py").write_text("class Main:\n    pass\n")
+
+    # build/、dist/ 等目录可能是项目自己的源码包，不能被跳过
+    (jules_workspace / "build").mkdir()
+    (jules_workspace / "build" / "steps.py").write_text("class Step:\n    pass\n")
+
+    assert tools.detect_project_language() == "python"
+    structure = tools.list_project_structure()
+    assert "node_modules" not in structure
+    assert "build/steps.py" in structure
+
+def test_replace_with_git_merge_diff_replaces_literal_block_once():
+    """测试 replace_with_git_merge_diff 按字面量替换第一处匹配，且不解释替换内容中的反斜杠。"""
+    tools.overwrite_file_with_block("paths.py", "SEP = '/'\nSEP = '/'\n")
+    edit = "<<<<<<< SEARCH\nSEP = '/'\n=======\nSEP = '\\\\1'\n>>>>>>> REPLACE"
+
+    result = tools.replace_with_git_merge_diff("paths.py", edit)
+
+    assert "成功" in result
+    assert tools.read_file("paths.py") == "SEP = '\\\\1'\nSEP = '/'\n"
+
+def test_overwrite_file_is_atomic_and_keeps_permissions(jules_workspace):
+    """测试覆盖写入是否保留原文件权限，且不会在工作区留下临时文件。"""
+    script = jules_workspace / "run.sh"
+    script.write_text("echo old\n")
+    script.chmod(0o755)
+
+    result = tools.overwrite_file_with_block("run.sh", "echo new\n")
+
+    assert "成功" in result
+    assert script.read_text() == "echo new\n"
+    assert script.stat().st_mode & 0o777 == 0o755
+    assert [p.name for p in jules_workspace.iterdir()] == ["run.sh"]
+
+def test_atomic_write_honours_umask_and_runtime_fast_writes(jules_workspace, monkeypatch, record_calls):
+    """测试新文件按 umask 创建，且运行时修改 FAST_WRITES 会立即生效。"""
+    old_umask = os.umask(0o002)
+    try:
+        assert "成功" in tools.create_file_with_block("new.txt", "data\n")
+    finally:
+        os.umask(old_umask)
+    assert (jules_workspace / "new.txt").stat().st_mode & 0o777 == 0o664
+
+    fsync_calls = record_calls(os, "fsync")
+    monkeypatch.setattr(tools, "FAST_WRITES", True)
+    tools.overwrite_file_with_block("new.txt", "fast\n")
+    assert fsync_calls == []
+    monkeypatch.setattr(tools, "FAST_WRITES", False)
+    tools.overwrite_file_with_block("new.txt", "durable\n")
+    assert len(fsync_calls) == 1
+
+def test_git_tools_reuse_cached_repo_handle(jules_workspace):
+    """测试 git 工具是否在多次调用之间复用同一个 Repo 句柄，并能正常提交。"""
+    import git
+    git.Repo.init(jules_workspace)
+    tools.overwrite_file_with_block("a.txt", "hello\n")
+
+    repo = tools._get_repo()
+    assert tools._get_repo() is repo
+
+    assert "成功" in tools.git_add("a.txt")
+    assert "成功提交" in tools.git_commit("add a.txt")
+    assert repo.head.commit.message.strip() == "add a.txt"
+
+    # 一次暂存多个文件，包括一个新文件和一个已删除的文件
+    tools.overwrite_file_with_block("b.txt", "world\n")
+    tools.delete_file("a.txt")
+    assert "成功" in tools.git_add_many(["a.txt", "b.txt"])
+    assert sorted(path for path, _ in repo.index.entries) == ["b.txt"]
+
+    # 没有未暂存的变更时，git_diff 返回已暂存的变更
+    diff = tools.git_diff()
+    assert "--- a/a.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-hello" in diff
+    assert "--- /dev/null\n+++ b/b.txt\n@@ -0,0 +1 @@\n+world" in diff
+
+def test_get_safe_path_rechecks_symlinks_replaced_after_use(jules_workspace, tmp_path):
+    """测试目录在使用后被替换为指向工作区外的符号链接时，后续写入仍会被拒绝。"""
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    tools.overwrite_file_with_block("sub/a.txt", "inside")
+    assert tools.read_file("sub/a.txt") == "inside"
+
+    # 模拟执行的代码绕过文件工具，把 sub 目录替换成指向工作区外的符号链接
+    (jules_workspace / "sub" / "a.txt").unlink()
+    (jules_workspace / "sub").rmdir()
+    (jules_workspace / "sub").symlink_to(outside, target_is_directory=True)
+
+    result = tools.overwrite_file_with_block("sub/a.txt", "escaped")
+    assert "试图逃离允许的工作区" in result
+    assert not (outside / "a.txt").exists()
+
+def test_git_add_respects_gitignore_and_skips_git_dir(jules_workspace):
+    """测试 git_add 与 `git add` 一致：不暂存被忽略的文件，也拒绝 .git/ 内部文件。"""
+    import git
+    repo = git.Repo.init(jules_workspace)
+    tools.overwrite_file_with_block(".gitignore", "*.log\nsecret/\n")
+    tools.overwrite_file_with_block("src/app.py", "print('hi')\n")
+    tools.overwrite_file_with_block("src/debug.log", "noise\n")
+    tools.overwrite_file_with_block("src/secret/key", "hunter2\n")
+    tools.overwrite_file_with_block("top.log", "noise\n")
+
+    assert "成功" in tools.git_add("src")
+    assert "失败" in tools.git_add("top.log")
+    tools.git_add(".git/description")
+    assert sorted(path for path, _ in repo.index.entries) == ["src/app.py"]
+
+def test_git_diff_shows_staged_changes_before_first_commit_and_renames(jules_workspace, assert_all_in):
+    """测试 git_diff 在还没有提交时也能显示已暂存的变更，并保留重命名的头部信息。"""
+    import git
+    repo = git.Repo.init(jules_workspace)
+    tools.overwrite_file_with_block("old.txt", "one\ntwo\nthree\nfour\n")
+    tools.git_add("old.txt")
+
+    diff = tools.git_diff()
+    assert "--- /dev/null\n+++ b/old.txt\n@@ -0,0 +1,4 @@\n+one" in diff
+
+    tools.git_commit("add old.txt")
+    repo.git.mv("old.txt", "new.txt")
+    tools.overwrite_file_with_block("new.txt", "one\ntwo\nthree\nfour\nfive\n")
+    tools.git_add("new.txt")
+
+    diff = tools.git_diff()
+    assert_all_in(diff, [
+        "diff --git a/old.txt b/new.txt",
+        "rename from old.txt\nrename to new.txt",
+        "--- a/old.txt\n+++ b/new.txt",
+        "+five",
+    ])
+
+def test_git_diff_matches_git_headers_for_modes_and_binaries(jules_workspace):
+    """测试 git_diff 的输出除 index 行外与 `git diff` 一致：包括模式变化、新增/删除文件模式和二进制文件。"""
+    import git
+    repo = git.Repo.init(jules_workspace)
+    (jules_workspace / "run.sh").write_text("echo hi\n")
+    (jules_workspace / "gone.txt").write_text("bye\n")
+    (jules_workspace / "blob.bin").write_bytes(b"\0\1data")
+    tools.git_add_many(["run.sh", "gone.txt", "blob.bin"])
+    tools.git_commit("initial")
+
+    (jules_workspace / "run.sh").chmod(0o755)
+    (jules_workspace / "gone.txt").unlink()
+    (jules_workspace / "blob.bin").write_bytes(b"\0\2other")
+
+    def without_index_lines(text):
+        return [line for line in text.splitlines() if not line.startswith("index ")]
+
+    assert without_index_lines(tools.git_diff()) == ["Git Diff:"] + without_index_lines(repo.git.diff())
+
+    tools.git_add_many(["run.sh", "gone.txt", "blob.bin"])
+    tools.overwrite_file_with_block("added.txt", "new\n")
+    tools.git_add("added.txt")
+    assert without_index_lines(tools.git_diff()) == ["Git Diff:"] + without_index_lines(repo.git.diff("--staged"))
+
+@pytest.mark.parametrize("filepath", [
+    "../outside.txt",
+    "../../../etc/passwd",
+    "/some/other/path/file.txt",
+])
+def test_get_safe_path_rejects_paths_outside_workspace(filepath):
+    """测试 _get_safe_path 会拒绝相对路径穿越和工作区之外的绝对路径。"""
+    with pytest.raises(ValueError, match="试图逃离允许的工作区"):
+        tools._get_safe_path(filepath)